@@ -0,0 +1,55 @@
+"""Throughput benchmark: per-IMEI lookups vs POST /inventory/lookup batch resolution
+
+Seeds a scratch database (<DB_NAME>_lookup_bench) and drops it afterwards.
+Usage: python benchmark_imei_lookup.py [catalog_size] [pallet_size]
+"""
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from datetime import datetime, timezone
+import os
+import sys
+import time
+import asyncio
+
+load_dotenv('.env')
+
+async def benchmark(catalog_size: int, pallet_size: int):
+    import server
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    bench_db = client[f"{os.environ['DB_NAME']}_lookup_bench"]
+    server.db = bench_db
+    user = server.User(user_id="bench", email="bench@magnova.com", name="Bench", organization="Nova",
+                       role="Admin", created_at=datetime.now(timezone.utc))
+    try:
+        await bench_db.imei_catalog.create_index("imei", unique=True)
+        await bench_db.imei_catalog.insert_many([
+            {"imei": f"86{i:013d}", "in_inventory": True, "in_procurement": True, "brand": "Apple",
+             "model": "iPhone 15", "status": "Procured", "po_number": f"PO-MAG-{i % 500:05d}"}
+            for i in range(catalog_size)
+        ])
+        # Every 10th IMEI on the pallet is unknown
+        pallet = [f"86{i:013d}" if i % 10 else f"99{i:013d}" for i in range(pallet_size)]
+
+        start = time.perf_counter()
+        for imei in pallet:
+            await server.lookup_imei(imei, user)
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = await server.batch_lookup_imeis(server.IMEIBatchLookup(imeis=pallet), user)
+        batch = time.perf_counter() - start
+
+        print(f"Pallet of {pallet_size} IMEIs against a catalog of {catalog_size}:")
+        print(f"  per-IMEI lookups : {single:8.3f}s  ({pallet_size / single:10.0f} IMEIs/s)")
+        print(f"  batch lookup     : {batch:8.3f}s  ({pallet_size / batch:10.0f} IMEIs/s)")
+        print(f"  found {result['found']}, missing {result['missing']}, speed-up x{single / batch:.1f}")
+        print("  (HTTP/TLS/auth overhead per request is not included in the per-IMEI figure)")
+    finally:
+        await client.drop_database(bench_db.name)
+        client.close()
+
+if __name__ == "__main__":
+    catalog_size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    pallet_size = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    asyncio.run(benchmark(catalog_size, pallet_size))
@@ -1,11 +1,15 @@
 """
 Clear all fake data from MongoDB
+
+Usage: python clear_data.py [--fast]
+  --fast  drop the transactional collections (server.RESET_COLLECTIONS) and rebuild their indexes
 """
 
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from pathlib import Path
 import os
+import sys
 import asyncio
 
 ROOT_DIR = Path(__file__).parent
@@ -49,5 +53,29 @@ async def clear_database():
     finally:
         client.close()
 
+async def fast_reset():
+    """Drop and recreate collections using the server's index declarations"""
+    import server
+    print("=" * 60)
+    print("Fast reset: dropping collections and rebuilding indexes...")
+    print("=" * 60)
+    
+    try:
+        counts = await server.reset_database(db)
+        for collection, count in counts.items():
+            print(f"✓ Dropped {collection}: ~{count} documents")
+        print("\n" + "=" * 60)
+        print("✓ Database reset successfully!")
+        print("=" * 60)
+    except Exception as e:
+        print(f"\n✗ Error resetting database: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        client.close()
+
 if __name__ == "__main__":
-    asyncio.run(clear_database())
+    if "--fast" in sys.argv[1:]:
+        asyncio.run(fast_reset())
+    else:
+        asyncio.run(clear_database())
@@ -1,14 +1,16 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect, status, UploadFile, File, Form, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError
+from typing import List, Optional, Dict, Any, Callable, Tuple
 from datetime import datetime, timezone, timedelta
 import jwt
 from passlib.context import CryptContext
@@ -36,10 +38,108 @@ db = client[os.environ['DB_NAME']]
 genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
 
 # Create indexes
-async def create_indexes():
-    await db.users.create_index("email", unique=True)
-    await db.imei_inventory.create_index("imei", unique=True)
-    await db.purchase_orders.create_index("po_number", unique=True)
+def declared_indexes() -> Dict[str, List[IndexModel]]:
+    """Every collection's indexes, so a dropped collection can be rebuilt (see reset_database)"""
+    return {
+        "users": [IndexModel("email", unique=True)],
+        "imei_inventory": [
+            IndexModel("imei", unique=True),
+            IndexModel("imei2"),
+            IndexModel([("current_location", 1), ("status", 1), ("imei", 1)]),
+            IndexModel([("organization", 1), ("status", 1)]),
+            IndexModel([("brand", 1), ("model", 1)]),
+            IndexModel([("model", 1), ("current_location", 1), ("status", 1)]),
+        ],
+        "imei_catalog": [IndexModel("imei", unique=True)],
+        "procurement": [IndexModel("imei"), IndexModel("po_number"), IndexModel("serial_number"), IndexModel("vendor_name")],
+        "po_items": [
+            IndexModel([("po_number", 1), ("line", 1)], unique=True),
+            IndexModel([("po_number", 1), ("imei", 1)]),
+            IndexModel([("po_number", 1), ("vendor", 1)]),
+        ],
+        "scan_dedup": [IndexModel("created_at", expireAfterSeconds=SCAN_DEDUP_WINDOW_SECONDS)],
+        "inventory_aging_snapshots": [IndexModel([("snapshot_date", 1), ("filter_key", 1)], unique=True)],
+        "vendor_analytics_snapshots": [IndexModel("snapshot_date", unique=True)],
+        "stock_takes": [IndexModel("session_id", unique=True)],
+        "stock_take_scans": [IndexModel("session_id")],
+        "purchase_orders": [IndexModel("po_number", unique=True)],
+        "audit_logs": audit_log_indexes(),
+        "imei_events": [IndexModel([("imei", 1), ("timestamp", 1)]), IndexModel([("location", 1), ("timestamp", 1)])],
+        "shipment_items": [
+            IndexModel([("shipment_id", 1), ("position", 1)], unique=True),
+            IndexModel("imei"),
+            IndexModel("po_number"),
+        ],
+        "po_delete_jobs": [IndexModel("job_id", unique=True), IndexModel([("status", 1), ("lease_until", 1)])],
+        "payments": [IndexModel("po_number"), IndexModel("utr_number")],
+        "logistics_shipments": [IndexModel("po_number")],
+        "invoices": [IndexModel("po_number"), IndexModel("invoice_number")],
+        "sales_orders": [IndexModel("so_number")],
+        # Closed PO archive (see POArchiveJob)
+        "purchase_orders_archive": [IndexModel("po_number", unique=True), IndexModel("created_at")],
+        "procurement_archive": [IndexModel("po_number"), IndexModel("imei")],
+        "payments_archive": [IndexModel("po_number")],
+        "logistics_shipments_archive": [IndexModel("po_number")],
+        "shipment_items_archive": [IndexModel("po_number"), IndexModel("imei")],
+        "invoices_archive": [IndexModel("po_number")],
+        "po_items_archive": [IndexModel([("po_number", 1), ("line", 1)], unique=True)],
+        "notifications": [
+            IndexModel([("target_user_id", 1), ("created_at", -1)]),
+            IndexModel([("role", 1), ("created_at", -1)]),
+            IndexModel([("type", 1), ("procurement_id", 1)]),
+            IndexModel([("type", 1), ("status", 1), ("is_escalated", 1), ("deadline", 1)]),
+            IndexModel("escalation_batch", sparse=True),
+        ],
+    }
+
+async def _create_collection_indexes(database, name: str, indexes: List[IndexModel]):
+    try:
+        await database[name].create_indexes(indexes)
+    except OperationFailure as e:
+        if e.code != 85:  # IndexOptionsConflict
+            raise
+        # A TTL that changed through the environment (e.g. SCAN_DEDUP_WINDOW_SECONDS) is
+        # updated in place with collMod; any other conflict is raised by the retry
+        existing = await database[name].index_information()
+        for index in indexes:
+            spec = index.document
+            if "expireAfterSeconds" in spec and spec["name"] in existing \
+                    and existing[spec["name"]].get("expireAfterSeconds") != spec["expireAfterSeconds"]:
+                await database.command("collMod", name, index={"name": spec["name"], "expireAfterSeconds": spec["expireAfterSeconds"]})
+        await database[name].create_indexes(indexes)
+
+async def create_indexes(database=None):
+    """One createIndexes command per collection, all collections in parallel"""
+    database = db if database is None else database
+    await asyncio.gather(*(_create_collection_indexes(database, name, indexes) for name, indexes in declared_indexes().items()))
+
+# Transactional collections cleared by both reset modes (see clear_all_data). Accounts,
+# pending admin sign-ups, notifications and sales orders are left alone.
+RESET_COLLECTIONS = (
+    "purchase_orders", "po_items", "procurement", "payments", "logistics_shipments", "shipment_items",
+    "invoices", "imei_inventory", "imei_catalog", "imei_events", "audit_logs", "counters",
+    "purchase_orders_archive", "po_items_archive", "procurement_archive", "payments_archive",
+    "logistics_shipments_archive", "shipment_items_archive", "invoices_archive",
+    "inventory_aging_snapshots", "vendor_analytics_snapshots", "stock_takes", "stock_take_scans",
+    "scan_dedup", "po_delete_jobs",
+)
+
+async def reset_collection_names(database) -> List[str]:
+    """RESET_COLLECTIONS plus the monthly audit archives that exist"""
+    archives = [n for n in await database.list_collection_names() if n.startswith(AUDIT_ARCHIVE_PREFIX)]
+    return list(RESET_COLLECTIONS) + sorted(archives)
+
+async def reset_database(database) -> Dict[str, int]:
+    """Drop the reset collections and rebuild the declared indexes; returns approximate document counts dropped.
+
+    Dropping is a single metadata operation per collection, instead of one delete (and
+    one oplog entry) per document as with delete_many({}).
+    """
+    names = await reset_collection_names(database)
+    counts = await asyncio.gather(*(database[n].estimated_document_count() for n in names))
+    await asyncio.gather(*(database.drop_collection(n) for n in names))
+    await create_indexes(database)
+    return dict(zip(names, counts))
 
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -288,6 +388,7 @@ class IMEIScan(BaseModel):
     storage: Optional[str] = None
     colour: Optional[str] = None
     inward_date: Optional[datetime] = None
+    idempotency_key: Optional[str] = None
 
 class LogisticsShipment(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -302,7 +403,7 @@ class LogisticsShipment(BaseModel):
     expected_delivery: datetime
     actual_delivery: Optional[datetime] = None
     status: str
-    imei_list: List[str]
+    item_count: int = 0
     pickup_quantity: Optional[int] = 0
     brand: Optional[str] = None
     model: Optional[str] = None
@@ -415,8 +516,11 @@ def create_token(user_id: str, email: str) -> str:
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await get_user_from_token(credentials.credentials)
+
+async def get_user_from_token(token: str) -> User:
+    """Resolve a JWT to a User. Shared by header auth and clients (EventSource) that can only pass a query token."""
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("sub")
         user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
@@ -440,11 +544,13 @@ async def create_audit_log(action: str, entity_type: str, entity_id: str, user:
         "details": details,
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
-    await db.audit_logs.insert_one(log)
+    # Buffered: written by audit_sink in insert_many batches (see AuditLogSink)
+    await audit_sink.enqueue(log)
 
 # ── SMTP Email Helper (runs in thread executor so it doesn't block async loop) ──
 import asyncio
 import functools
+import itertools
 
 def _send_smtp_sync(to_email: str, subject: str, html_body: str):
     """Blocking SMTP send – called via run_in_executor so it won't block FastAPI."""
@@ -510,6 +616,214 @@ async def send_smtp_email(to_email: str, subject: str, html_body: str) -> bool:
     )
 # ────────────────────────────────────────────────────────────────────────────────
 
+# ── Background jobs (in-process, started/stopped with the app) ────────────────
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+class PeriodicJob:
+    """Calls `run_once` every `interval` seconds until stopped.
+
+    Jobs read the time through `self.clock` so tests can drive them with a fake clock
+    and call `run_once` directly instead of waiting on the loop.
+    """
+    name = "job"
+
+    def __init__(self, interval: float, clock: Callable[[], datetime] = utc_now):
+        self.interval = interval
+        self.clock = clock
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self):
+        raise NotImplementedError
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Background job '{self.name}' failed: {e}")
+            await asyncio.sleep(self.interval)
+# ────────────────────────────────────────────────────────────────────────────────
+
+# ── Buffered audit-log writer ─────────────────────────────────────────────────
+from collections import deque
+from pymongo.errors import BulkWriteError, PyMongoError
+
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", 200))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", 1.0))
+AUDIT_MAX_BUFFER = int(os.environ.get("AUDIT_MAX_BUFFER", 10000))
+# Optional JSONL file that receives audit entries while MongoDB is unreachable
+AUDIT_SPILL_PATH = os.environ.get("AUDIT_SPILL_PATH")
+
+class AuditLogSink:
+    """Buffers audit entries in memory and writes them to MongoDB with insert_many.
+
+    A batch is flushed once `batch_size` entries are waiting or every `flush_interval`
+    seconds. A single flusher drains the buffer in FIFO order, so entries for the same
+    entity are stored in the order they were logged. If MongoDB is unreachable the batch
+    is appended to `spill_path` (when configured) and replayed ahead of newer entries once
+    writes succeed again; otherwise it stays buffered. When the buffer is full `enqueue`
+    waits for the next flush, which is what `stats()["backpressure_waits"]` counts.
+
+    Until `start()` is called (scripts, tests) entries are written straight through.
+    """
+
+    def __init__(self, collection, batch_size: int = AUDIT_BATCH_SIZE, flush_interval: float = AUDIT_FLUSH_INTERVAL,
+                 max_buffer: int = AUDIT_MAX_BUFFER, spill_path: Optional[str] = AUDIT_SPILL_PATH):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.spill_path = Path(spill_path) if spill_path else None
+        self._buffer: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._counters = {"flushed": 0, "spilled": 0, "replayed": 0, "backpressure_waits": 0, "high_water_mark": 0}
+        self._last_error: Optional[str] = None
+        self._last_flush_at: Optional[str] = None
+
+    async def enqueue(self, entry: dict):
+        if self._task is None:
+            await self.collection.insert_one(entry)
+            return
+        while len(self._buffer) >= self.max_buffer:
+            self._counters["backpressure_waits"] += 1
+            self._drained.clear()
+            self._wakeup.set()
+            await self._drained.wait()
+        self._buffer.append(entry)
+        self._counters["high_water_mark"] = max(self._counters["high_water_mark"], len(self._buffer))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write out everything still buffered."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "max_buffer": self.max_buffer,
+            "buffer_utilization": round(len(self._buffer) / self.max_buffer, 4) if self.max_buffer else 0,
+            **self._counters,
+            "spill_pending": self._spill_pending(),
+            "last_error": self._last_error,
+            "last_flush_at": self._last_flush_at,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Audit sink flush failed: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            # Spilled entries are older than anything buffered; they must land first
+            if self._spill_pending() and not await self._replay_spill():
+                self._spill(list(self._buffer))
+                self._buffer.clear()
+            while self._buffer:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                unwritten = await self._write(batch)
+                if unwritten:
+                    if self.spill_path:
+                        self._spill(unwritten + list(self._buffer))
+                        self._buffer.clear()
+                    else:
+                        self._buffer.extendleft(reversed(unwritten))
+                    break
+            self._last_flush_at = datetime.now(timezone.utc).isoformat()
+            self._drained.set()
+
+    async def _write(self, batch: List[dict]) -> List[dict]:
+        """Insert `batch` in order; returns the entries that could not be written."""
+        while batch:
+            try:
+                await self.collection.insert_many(batch, ordered=True)
+                self._counters["flushed"] += len(batch)
+                return []
+            except BulkWriteError as e:
+                inserted = e.details.get("nInserted", 0)
+                self._counters["flushed"] += inserted
+                errors = e.details.get("writeErrors", [])
+                if not errors or errors[0].get("code") != 11000:
+                    self._last_error = str(errors[0].get("errmsg") if errors else e)
+                    return batch[inserted:]
+                # Duplicate log_id: already stored by an earlier, partially acknowledged attempt
+                batch = batch[inserted + 1:]
+            except PyMongoError as e:
+                self._last_error = str(e)
+                logging.warning(f"Audit sink: MongoDB write failed ({e}); {len(batch)} entries held back")
+                return batch
+        return []
+
+    def _spill_pending(self) -> bool:
+        return bool(self.spill_path and self.spill_path.exists() and self.spill_path.stat().st_size > 0)
+
+    def _spill(self, entries: List[dict]):
+        if not entries:
+            return
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            f.writelines(self._spill_line(entry) for entry in entries)
+        self._counters["spilled"] += len(entries)
+
+    @staticmethod
+    def _spill_line(entry: dict) -> str:
+        return json.dumps({k: v for k, v in entry.items() if k != "_id"}, default=str) + "\n"
+
+    async def _replay_spill(self) -> bool:
+        with open(self.spill_path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        for i in range(0, len(entries), self.batch_size):
+            unwritten = await self._write(entries[i:i + self.batch_size])
+            if unwritten:
+                remaining = unwritten + entries[i + self.batch_size:]
+                with open(self.spill_path, "w", encoding="utf-8") as f:
+                    f.writelines(self._spill_line(entry) for entry in remaining)
+                self._counters["replayed"] += len(entries) - len(remaining)
+                return False
+        self.spill_path.write_text("")
+        self._counters["replayed"] += len(entries)
+        return True
+
+audit_sink = AuditLogSink(db.audit_logs)
+# ────────────────────────────────────────────────────────────────────────────────
+
 # Auth Endpoints
 @api_router.post("/auth/send-otp")
 async def send_otp(req: OTPRequest):
@@ -797,18 +1111,8 @@ async def create_purchase_order(po_data: POCreate, current_user: User = Depends(
     if current_user.role.lower() not in ["admin", "purchase"]:
         raise HTTPException(status_code=403, detail="Only Admins or Purchase Team can create POs")
     
-    # Generate unique PO number and check for duplicates
-    po_count = await db.purchase_orders.count_documents({}) + 1
-    po_number = f"PO-MAG-{po_count:05d}"
-    
-    # Check if PO number already exists (shouldn't happen but safety check)
-    existing_po = await db.purchase_orders.find_one({"po_number": po_number})
-    if existing_po:
-        # Find next available number
-        while existing_po:
-            po_count += 1
-            po_number = f"PO-MAG-{po_count:05d}"
-            existing_po = await db.purchase_orders.find_one({"po_number": po_number})
+    # Same counter as the bulk import, so the two never hand out the same number
+    po_number = (await reserve_po_numbers(1))[0]
     
     # Calculate totals from items
     total_quantity = sum(item.qty for item in po_data.items)
@@ -839,13 +1143,194 @@ async def create_purchase_order(po_data: POCreate, current_user: User = Depends(
     }
     
     await db.purchase_orders.insert_one(po_doc)
+    await index_po_items(po_number, items_list)
     await create_audit_log("CREATE", "PurchaseOrder", po_number, current_user, {"total_quantity": total_quantity, "total_value": total_value})
     
     return PurchaseOrder(**{k: v for k, v in po_doc.items() if k != "_id"})
 
+# ── PO import (xlsx / CSV) ────────────────────────────────────────────────────
+# Rows are parsed off the event loop in chunks of PO_IMPORT_CHUNK_ROWS and validated a
+# chunk at a time with pandas; only validated line items are kept. Rows sharing a
+# `po_ref` become one PO (no po_ref column: the whole file is one PO). A PO with any
+# invalid row is not created; its row errors are reported instead.
+PO_IMPORT_CHUNK_ROWS = 1000
+PO_IMPORT_MAX_ROWS = int(os.environ.get("PO_IMPORT_MAX_ROWS", 50000))
+PO_IMPORT_MAX_ERRORS = 1000
+PO_IMPORT_REQUIRED = ["vendor", "location", "brand", "model", "rate"]
+PO_IMPORT_COLUMNS = PO_IMPORT_REQUIRED + ["po_ref", "storage", "colour", "imei", "qty", "po_value"]
+
+def _iter_upload_rows(upload: UploadFile):
+    """Yield the header and then each row of an uploaded .xlsx or .csv as a tuple, without reading it all"""
+    name = (upload.filename or "").lower()
+    if name.endswith(".xlsx"):
+        from openpyxl import load_workbook
+        workbook = load_workbook(upload.file, read_only=True, data_only=True)
+        try:
+            for row in workbook.active.iter_rows(values_only=True):
+                yield row
+        finally:
+            workbook.close()
+    elif name.endswith(".csv"):
+        import csv
+        yield from csv.reader(io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline=""))
+    else:
+        raise HTTPException(status_code=400, detail="Upload an .xlsx or .csv file")
+
+def _validate_po_rows(rows: List[tuple], columns: List[str], first_row: int):
+    """Vectorized checks over one chunk. Returns (line items with their po_ref, row errors)."""
+    import pandas as pd
+
+    # dtype=object: a numeric IMEI column with blank cells would otherwise become float64
+    df = pd.DataFrame([list(r)[:len(columns)] + [None] * (len(columns) - len(r)) for r in rows], columns=columns, dtype=object)
+    df = df.reindex(columns=PO_IMPORT_COLUMNS).replace(r"^\s*$", None, regex=True)
+    df["row"] = range(first_row, first_row + len(df))
+    text = ["po_ref", "vendor", "location", "brand", "model", "storage", "colour", "imei"]
+    # Spreadsheet numbers can still arrive as whole floats (356789012345678.0); keep their digits
+    df[text] = df[text].apply(lambda col: col.map(lambda v: str(int(v)) if isinstance(v, float) and v.is_integer() else v)
+                              .astype("string").str.strip().replace("", pd.NA))
+    # Blank spreadsheet rows are skipped, not reported
+    df = df[df.drop(columns="row").notna().any(axis=1)]
+
+    rate = pd.to_numeric(df["rate"], errors="coerce")
+    qty = pd.to_numeric(df["qty"], errors="coerce").where(df["qty"].notna(), 1)
+    po_value = pd.to_numeric(df["po_value"], errors="coerce").where(df["po_value"].notna(), qty * rate)
+    checks = [(df[col].isna(), col, "is required") for col in PO_IMPORT_REQUIRED if col != "rate"]
+    checks += [
+        (rate.isna() | (rate <= 0), "rate", "must be a positive number"),
+        (qty.isna() | (qty < 1) | (qty % 1 != 0), "qty", "must be a whole number of at least 1"),
+        (df["po_value"].notna() & (po_value.isna() | (po_value < 0)), "po_value", "must be a non-negative number"),
+        (df["imei"].notna() & ~df["imei"].str.fullmatch(r"\d{14,16}").fillna(False).astype(bool), "imei", "must be 14-16 digits"),
+    ]
+    errors, bad = [], pd.Series(False, index=df.index)
+    for mask, column, message in checks:
+        mask = mask.fillna(True).astype(bool)
+        bad |= mask
+        errors.extend({"row": int(r), "po_ref": ref if ref is not pd.NA else None, "column": column, "message": f"{column} {message}"}
+                      for r, ref in zip(df.loc[mask, "row"], df.loc[mask, "po_ref"]))
+
+    errors.sort(key=lambda e: e["row"])
+    good = df[~bad]
+    items = [
+        (ref if ref is not pd.NA else None, {
+            "vendor": vendor, "location": location, "brand": brand, "model": model,
+            "storage": None if storage is pd.NA else storage, "colour": None if colour is pd.NA else colour,
+            "imei": None if imei is pd.NA else imei, "qty": int(q), "rate": float(r), "po_value": float(v),
+        })
+        for ref, vendor, location, brand, model, storage, colour, imei, q, r, v in zip(
+            good["po_ref"], good["vendor"], good["location"], good["brand"], good["model"], good["storage"],
+            good["colour"], good["imei"], qty[~bad], rate[~bad], po_value[~bad])
+    ]
+    return items, errors
+
+async def _highest_po_number() -> int:
+    """Numeric maximum over live and archived PO numbers ("PO-MAG-100000" sorts below "PO-MAG-99999" as text)"""
+    highest = 0
+    for collection in ("purchase_orders", archive_name("purchase_orders")):
+        cursor = db[collection].find({"po_number": {"$regex": r"^PO-MAG-\d+$"}}, {"_id": 0, "po_number": 1})
+        async for po in cursor.batch_size(5000):
+            highest = max(highest, int(po["po_number"].rsplit("-", 1)[1]))
+    return highest
+
+async def reserve_po_numbers(count: int) -> List[str]:
+    """Allocate `count` consecutive PO numbers; every PO create path draws from this counter"""
+    if await db.counters.count_documents({"_id": "po_number"}, limit=1) == 0:
+        # First allocation since deploy or reset: seed past the existing POs. $max keeps
+        # concurrent seeders (and any numbers already handed out) safe.
+        await db.counters.update_one({"_id": "po_number"}, {"$max": {"seq": await _highest_po_number()}}, upsert=True)
+    counter = await db.counters.find_one_and_update({"_id": "po_number"}, {"$inc": {"seq": count}}, return_document=True)
+    return [f"PO-MAG-{n:05d}" for n in range(counter["seq"] - count + 1, counter["seq"] + 1)]
+
+@api_router.post("/purchase-orders/import")
+async def import_purchase_orders(
+    file: UploadFile = File(...),
+    purchase_office: str = Form(...),
+    po_date: Optional[datetime] = Form(None),
+    notes: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_user),
+):
+    from uuid import uuid4
+    if current_user.role.lower() not in ["admin", "purchase"]:
+        raise HTTPException(status_code=403, detail="Only Admins or Purchase Team can create POs")
+
+    rows = _iter_upload_rows(file)
+    header = await asyncio.to_thread(next, rows, None)
+    if header is None:
+        raise HTTPException(status_code=400, detail="The file is empty")
+    columns = [str(h).strip().lower().replace(" ", "_") if h is not None else "" for h in header]
+    missing_columns = [c for c in PO_IMPORT_REQUIRED if c not in columns]
+    if missing_columns:
+        raise HTTPException(status_code=400, detail=f"Missing columns: {', '.join(missing_columns)}")
+    repeated = sorted({c for c in columns if c in PO_IMPORT_COLUMNS and columns.count(c) > 1})
+    if repeated:
+        raise HTTPException(status_code=400, detail=f"Repeated columns: {', '.join(repeated)}")
+    columns = [c if c in PO_IMPORT_COLUMNS else f"_ignored_{i}" for i, c in enumerate(columns)]
+
+    groups: Dict[Optional[str], List[dict]] = {}
+    errors: List[dict] = []
+    failed_refs = set()
+    row_count = 0
+    while True:
+        chunk = await asyncio.to_thread(lambda: list(itertools.islice(rows, PO_IMPORT_CHUNK_ROWS)))
+        if not chunk:
+            break
+        if row_count + len(chunk) > PO_IMPORT_MAX_ROWS:
+            raise HTTPException(status_code=400, detail=f"At most {PO_IMPORT_MAX_ROWS} rows per import")
+        items, chunk_errors = await asyncio.to_thread(_validate_po_rows, chunk, columns, row_count + 2)
+        row_count += len(chunk)
+        for ref, item in items:
+            groups.setdefault(ref, []).append(item)
+        failed_refs.update(e["po_ref"] for e in chunk_errors)
+        errors.extend(chunk_errors[:max(0, PO_IMPORT_MAX_ERRORS - len(errors))])
+
+    refs = [ref for ref in groups if ref not in failed_refs]
+    rejected = sorted({str(ref) for ref in failed_refs if ref is not None}) + (["(no po_ref)"] if None in failed_refs else [])
+    if not refs:
+        return {"rows": row_count, "created": [], "rejected": rejected, "errors": errors}
+
+    now = datetime.now(timezone.utc).isoformat()
+    po_docs = []
+    for ref, po_number in zip(refs, await reserve_po_numbers(len(refs))):
+        items = [{"sl_no": n, **item} for n, item in enumerate(groups[ref], start=1)]
+        po_docs.append({
+            "po_id": str(uuid4()),
+            "po_number": po_number,
+            "po_date": (po_date or datetime.now(timezone.utc)).isoformat(),
+            "purchase_office": purchase_office,
+            "created_by": current_user.user_id,
+            "created_by_name": current_user.name,
+            "organization": current_user.organization,
+            "status": "Created",
+            "total_quantity": sum(item["qty"] for item in items),
+            "total_value": sum(item["po_value"] for item in items),
+            "items": items,
+            "notes": notes,
+            "import_ref": ref,
+            "approval_status": "Pending",
+            "approved_by": None,
+            "approved_at": None,
+            "rejection_reason": None,
+            "created_at": now,
+            "updated_at": now,
+        })
+    await db.purchase_orders.insert_many(po_docs)
+    await db.po_items.insert_many([
+        {"po_number": po["po_number"], "line": i, **item} for po in po_docs for i, item in enumerate(po["items"])
+    ])
+    for po in po_docs:
+        await create_audit_log("CREATE", "PurchaseOrder", po["po_number"], current_user,
+                               {"total_quantity": po["total_quantity"], "total_value": po["total_value"], "source": "import"})
+    return {
+        "rows": row_count,
+        "created": [{"po_number": po["po_number"], "po_ref": po["import_ref"], "lines": len(po["items"]),
+                     "total_quantity": po["total_quantity"], "total_value": po["total_value"]} for po in po_docs],
+        "rejected": rejected,
+        "errors": errors,
+    }
+# ────────────────────────────────────────────────────────────────────────────────
+
 @api_router.get("/purchase-orders", response_model=List[PurchaseOrder])
-async def get_purchase_orders(current_user: User = Depends(get_current_user)):
-    pos = await db.purchase_orders.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+async def get_purchase_orders(include_archive: bool = False, current_user: User = Depends(get_current_user)):
+    pos = await find_with_archive("purchase_orders", {}, {"_id": 0}, [("created_at", -1)], 1000, include_archive)
     for po in pos:
         if isinstance(po.get('created_at'), str):
             po['created_at'] = datetime.fromisoformat(po['created_at'])
@@ -867,8 +1352,10 @@ async def get_purchase_orders(current_user: User = Depends(get_current_user)):
     return [PurchaseOrder(**po) for po in pos]
 
 @api_router.get("/purchase-orders/{po_number}", response_model=PurchaseOrder)
-async def get_purchase_order(po_number: str, current_user: User = Depends(get_current_user)):
+async def get_purchase_order(po_number: str, include_archive: bool = False, current_user: User = Depends(get_current_user)):
     po = await db.purchase_orders.find_one({"po_number": po_number}, {"_id": 0})
+    if not po and include_archive:
+        po = await db[archive_name("purchase_orders")].find_one({"po_number": po_number}, {"_id": 0})
     if not po:
         raise HTTPException(status_code=404, detail="PO not found")
     if isinstance(po.get('created_at'), str):
@@ -916,13 +1403,75 @@ async def approve_purchase_order(po_number: str, approval: POApproval, current_u
     await db.purchase_orders.update_one({"po_number": po_number}, {"$set": update_data})
     return {"message": f"PO {approval.action}d successfully"}
 
+PO_BULK_APPROVAL_MAX = 500
+
+class POBulkApproval(BaseModel):
+    po_numbers: List[str]
+    action: str
+    rejection_reason: Optional[str] = None
+
+@api_router.post("/purchase-orders/bulk-approve")
+async def bulk_approve_purchase_orders(approval: POBulkApproval, current_user: User = Depends(get_current_user)):
+    """Approve or reject many pending POs with one guarded update_many; returns an outcome per PO"""
+    from uuid import uuid4
+    if current_user.role not in ["Approver", "Admin", "Manager"]:
+        raise HTTPException(status_code=403, detail="Only managers or approvers can approve POs")
+    if approval.action not in ["approve", "reject"]:
+        raise HTTPException(status_code=400, detail="action must be 'approve' or 'reject'")
+    po_numbers = list(dict.fromkeys(approval.po_numbers))
+    if len(po_numbers) > PO_BULK_APPROVAL_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {PO_BULK_APPROVAL_MAX} POs per request")
+
+    now = datetime.now(timezone.utc).isoformat()
+    # Tag the batch so the read-back can tell which POs this request changed
+    batch_id = str(uuid4())
+    update_data = {"updated_at": now, "approval_batch": batch_id}
+    if approval.action == "approve":
+        update_data.update({"approval_status": "Approved", "status": "Approved", "approved_by": current_user.user_id, "approved_at": now})
+    else:
+        update_data.update({"approval_status": "Rejected", "status": "Rejected", "rejection_reason": approval.rejection_reason})
+    await db.purchase_orders.update_many({"po_number": {"$in": po_numbers}, "approval_status": "Pending"}, {"$set": update_data})
+
+    current = {po["po_number"]: po for po in await db.purchase_orders.find(
+        {"po_number": {"$in": po_numbers}}, {"_id": 0, "po_number": 1, "approval_status": 1, "approval_batch": 1}
+    ).to_list(None)}
+    results, changed = [], []
+    for po_number in po_numbers:
+        po = current.get(po_number)
+        if po is None:
+            results.append({"po_number": po_number, "success": False, "error": "PO not found"})
+        elif po.get("approval_batch") == batch_id:
+            changed.append(po_number)
+            results.append({"po_number": po_number, "success": True, "approval_status": po["approval_status"]})
+        else:
+            results.append({"po_number": po_number, "success": False, "approval_status": po.get("approval_status"),
+                            "error": f"PO is not pending (already {po.get('approval_status')})"})
+
+    action, details = ("APPROVE", {}) if approval.action == "approve" else ("REJECT", {"reason": approval.rejection_reason})
+    for po_number in changed:
+        await create_audit_log(action, "PurchaseOrder", po_number, current_user, {**details, "bulk": True})
+    return {"updated": len(changed), "results": results}
+
 # Procurement Endpoints
+def _procured_inventory_fields(proc_doc: dict, po_item_data: Optional[dict]) -> dict:
+    """Inventory fields a procured unit carries before its first scan (stock levels and aging group on these)"""
+    po_item_data = po_item_data or {}
+    return {
+        "po_number": proc_doc.get("po_number"),
+        "purchase_price": proc_doc.get("purchase_price"),
+        "vendor": proc_doc.get("vendor_name") or po_item_data.get("vendor"),
+        "brand": po_item_data.get("brand"),
+        "model": po_item_data.get("model") or proc_doc.get("device_model"),
+        "storage": po_item_data.get("storage"),
+        "colour": po_item_data.get("colour"),
+    }
+
 @api_router.post("/procurement", response_model=ProcurementRecord)
 async def create_procurement(proc_data: ProcurementCreate, current_user: User = Depends(get_current_user)):
     from uuid import uuid4
     # Remove organization restriction - everyone can create procurement
     
-    po = await db.purchase_orders.find_one({"po_number": proc_data.po_number})
+    po = await db.purchase_orders.find_one({"po_number": proc_data.po_number}, {"_id": 1})
     if not po:
         raise HTTPException(status_code=400, detail="PO not found")
     
@@ -974,10 +1523,12 @@ async def create_procurement(proc_data: ProcurementCreate, current_user: User =
         {"$set": {"gap_qty": gap_qty, "gap_amt": gap_amt}}
     )
     
+    po_item_data = await find_po_item(proc_data.po_number, imei, proc_data.vendor_name)
     imei_doc = {
         "imei": imei,
         "procurement_id": proc_id,
         "device_model": proc_data.device_model,
+        **_procured_inventory_fields(proc_doc, po_item_data),
         "status": "Procured",
         "current_location": proc_data.store_location,
         "organization": current_user.organization,
@@ -989,11 +1540,170 @@ async def create_procurement(proc_data: ProcurementCreate, current_user: User =
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     await db.imei_inventory.insert_one(imei_doc)
+    inventory_rollups.invalidate()
+    await record_imei_events([imei_event(imei, "procured", None, imei_doc, current_user, "procurement", proc_id)])
+    await db.imei_catalog.replace_one(
+        {"imei": imei},
+        build_imei_catalog_entry(imei, imei_doc, proc_doc, po_item_data),
+        upsert=True
+    )
     
     await create_audit_log("CREATE", "Procurement", proc_id, current_user, {"imei": imei, "gap_qty": gap_qty})
     
     return ProcurementRecord(**{k: v for k, v in proc_doc.items() if k != "_id"})
 
+# ── Bulk procurement ──────────────────────────────────────────────────────────
+# Same per-record effect as POST /procurement, with set-based reads and writes: one
+# $in check each for POs and IMEIs, one aggregation for the purchased totals, gaps
+# computed once per PO, then insert_many / bulk_write for procurement and inventory.
+PROCUREMENT_BULK_MAX = int(os.environ.get("PROCUREMENT_BULK_MAX", 5000))
+
+async def ingest_procurement(entries: List[Tuple[int, ProcurementCreate]], current_user: User, errors: List[dict]) -> dict:
+    """Create procurement records for (row, entry) pairs; rejected rows are appended to `errors`"""
+    from uuid import uuid4
+    po_numbers = list({entry.po_number for _, entry in entries})
+    known_pos = set(await db.purchase_orders.distinct("po_number", {"po_number": {"$in": po_numbers}}))
+    imeis = {row: entry.imei or str(uuid4()).replace('-', '')[:15] for row, entry in entries}
+    existing = set(await db.procurement.distinct("imei", {"imei": {"$in": list(imeis.values())}}))
+
+    accepted, seen = [], set()
+    for row, entry in entries:
+        imei = imeis[row]
+        if entry.po_number not in known_pos:
+            errors.append({"row": row, "imei": imei, "error": "PO not found"})
+        elif imei in existing or imei in seen:
+            errors.append({"row": row, "imei": imei, "error": "IMEI already exists"})
+        else:
+            seen.add(imei)
+            accepted.append((row, imei, entry))
+    if not accepted:
+        return {"created": 0, "records": [], "gaps": {}}
+
+    # Gap per PO from everything already purchased plus this batch; as with single
+    # creates, the last entry for a PO sets its po_quantity and price basis
+    purchased = {row["_id"]: row["total"] async for row in db.procurement.aggregate([
+        {"$match": {"po_number": {"$in": list({e.po_number for _, _, e in accepted})}}},
+        {"$group": {"_id": "$po_number", "total": {"$sum": "$purchase_quantity"}}},
+    ])}
+    last_entry = {}
+    for _, _, entry in accepted:
+        purchased[entry.po_number] = purchased.get(entry.po_number, 0) + entry.purchase_quantity
+        last_entry[entry.po_number] = entry
+    gaps = {}
+    for po_number, entry in last_entry.items():
+        gap_qty = max(0, (entry.po_quantity or 1) - purchased[po_number])
+        gaps[po_number] = {"gap_qty": gap_qty, "gap_amt": gap_qty * entry.purchase_price}
+
+    now = datetime.now(timezone.utc).isoformat()
+    po_items = await load_po_item_candidates(
+        {imei: {"po_number": entry.po_number, "vendor_name": entry.vendor_name} for _, imei, entry in accepted},
+        [imei for _, imei, _ in accepted]
+    )
+    proc_docs, inventory_ops, new_units = [], [], []
+    for row, imei, entry in accepted:
+        proc_docs.append({
+            "procurement_id": str(uuid4()),
+            "po_number": entry.po_number,
+            "vendor_name": entry.vendor_name,
+            "store_location": entry.store_location,
+            "imei": imei,
+            "serial_number": entry.serial_number,
+            "device_model": entry.device_model,
+            "po_quantity": entry.po_quantity or 1,
+            "purchase_quantity": entry.purchase_quantity,
+            "purchase_price": entry.purchase_price,
+            "procurement_date": now,
+            "created_by": current_user.user_id,
+            **gaps[entry.po_number],
+            "settlement_amount": None,
+            "settlement_utr": None,
+            "settlement_date": None,
+            "gap_resolved": False,
+            "created_at": now,
+        })
+        # Units scanned before procurement already have an inventory record; link it instead
+        # (their scanned brand/model/vendor are kept)
+        fields = _procured_inventory_fields(
+            proc_docs[-1], _match_po_item(po_items.get(entry.po_number, []), imei, entry.vendor_name)
+        )
+        linked = {"procurement_id": proc_docs[-1]["procurement_id"], "po_number": fields.pop("po_number"),
+                  "purchase_price": fields.pop("purchase_price"), "updated_at": now}
+        new_units.append({
+            "device_model": entry.device_model,
+            **fields,
+            "status": "Procured",
+            "current_location": entry.store_location,
+            "organization": current_user.organization,
+            "inward_nova_date": None,
+            "inward_magnova_date": None,
+            "dispatched_date": None,
+            "sold_date": None,
+            "created_at": now,
+        })
+        inventory_ops.append(UpdateOne({"imei": imei}, {
+            "$set": linked,
+            "$setOnInsert": new_units[-1],
+        }, upsert=True))
+
+    await db.procurement.insert_many(proc_docs, ordered=False)
+    await db.procurement.bulk_write(
+        [UpdateMany({"po_number": po_number}, {"$set": gap}) for po_number, gap in gaps.items()], ordered=False
+    )
+    inventory_result = await db.imei_inventory.bulk_write(inventory_ops, ordered=False)
+    inventory_rollups.invalidate()
+    # Only units created here start their timeline; linked (already scanned) units keep theirs
+    await record_imei_events([
+        imei_event(proc_docs[i]["imei"], "procured", None, new_units[i], current_user,
+                   "procurement", proc_docs[i]["procurement_id"])
+        for i in sorted(inventory_result.upserted_ids)
+    ])
+    await refresh_imei_catalog([doc["imei"] for doc in proc_docs])
+    for doc in proc_docs:
+        await create_audit_log("CREATE", "Procurement", doc["procurement_id"], current_user,
+                               {"imei": doc["imei"], "gap_qty": doc["gap_qty"], "source": "bulk"})
+    return {
+        "created": len(proc_docs),
+        "records": [{"row": row, "imei": doc["imei"], "procurement_id": doc["procurement_id"]}
+                    for (row, _, _), doc in zip(accepted, proc_docs)],
+        "gaps": gaps,
+    }
+
+@api_router.post("/procurement/bulk")
+async def bulk_create_procurement(entries: List[ProcurementCreate], current_user: User = Depends(get_current_user)):
+    if len(entries) > PROCUREMENT_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {PROCUREMENT_BULK_MAX} records per request")
+    errors: List[dict] = []
+    result = await ingest_procurement(list(enumerate(entries)), current_user, errors)
+    return {**result, "errors": errors}
+
+@api_router.post("/procurement/bulk/upload")
+async def upload_procurement(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
+    """CSV or xlsx with ProcurementCreate fields as column headers; `row` in results is the sheet row"""
+    rows = _iter_upload_rows(file)
+    header = await asyncio.to_thread(next, rows, None)
+    if header is None:
+        raise HTTPException(status_code=400, detail="The file is empty")
+    columns = [str(h).strip().lower().replace(" ", "_") if h is not None else "" for h in header]
+    body = await asyncio.to_thread(lambda: list(itertools.islice(rows, PROCUREMENT_BULK_MAX + 1)))
+    if len(body) > PROCUREMENT_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {PROCUREMENT_BULK_MAX} records per upload")
+
+    entries, errors = [], []
+    for row, values in enumerate(body, start=2):
+        record = {c: (str(v).strip() if v is not None else "") for c, v in zip(columns, values) if c in ProcurementCreate.model_fields}
+        record = {c: v for c, v in record.items() if v != ""}
+        if not record:
+            continue
+        try:
+            entries.append((row, ProcurementCreate(**record)))
+        except ValidationError as e:
+            errors.append({"row": row, "imei": record.get("imei"),
+                           "error": "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())})
+    result = await ingest_procurement(entries, current_user, errors) if entries else {"created": 0, "records": [], "gaps": {}}
+    errors.sort(key=lambda e: e["row"])
+    return {**result, "errors": errors}
+# ────────────────────────────────────────────────────────────────────────────────
+
 class GapResolution(BaseModel):
     action: str  # 'reverse' or 'update'
     settlement_amount: Optional[float] = None
@@ -1018,9 +1728,11 @@ async def resolve_gap(procurement_id: str, resolution: GapResolution, current_us
             "status": "pending",
             "color": "red",
             "created_at": datetime.now(timezone.utc).isoformat(),
-            "deadline": (datetime.now(timezone.utc) + timedelta(hours=48)).isoformat()
+            "deadline": (datetime.now(timezone.utc) + timedelta(hours=48)).isoformat(),
+            "is_escalated": False
         }
         await db.notifications.insert_one(notification)
+        notification_broker.publish("created", _notification_payload(notification))
         await create_audit_log("GAP_REVERSE", "Procurement", procurement_id, current_user, {"message": "Reverse requested"})
 
         # ── Send SMTP email to the PO creator ──────────────────────────────
@@ -1134,10 +1846,13 @@ async def resolve_gap(procurement_id: str, resolution: GapResolution, current_us
         await db.procurement.update_one({"procurement_id": procurement_id}, {"$set": update_data})
         
         # ── Remove gap_reverse notification so header banner disappears ──
-        await db.notifications.delete_many({
-            "type": "gap_reverse",
-            "procurement_id": procurement_id
-        })
+        stale = await db.notifications.find(
+            {"type": "gap_reverse", "procurement_id": procurement_id}, {"_id": 1}
+        ).to_list(None)
+        if stale:
+            await db.notifications.delete_many({"_id": {"$in": [n["_id"] for n in stale]}})
+            for n in stale:
+                notification_broker.publish("removed", {"notification_id": str(n["_id"])})
         # ─────────────────────────────────────────────────────────────────
         
         await create_audit_log("GAP_UPDATE", "Procurement", procurement_id, current_user, {"settlement_amount": resolution.settlement_amount})
@@ -1146,12 +1861,12 @@ async def resolve_gap(procurement_id: str, resolution: GapResolution, current_us
     return {"message": "Resolution completed"}
 
 @api_router.get("/procurement", response_model=List[ProcurementRecord])
-async def get_procurement_records(po_number: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def get_procurement_records(po_number: Optional[str] = None, include_archive: bool = False, current_user: User = Depends(get_current_user)):
     query = {}
     if po_number:
         query["po_number"] = po_number
     
-    records = await db.procurement.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    records = await find_with_archive("procurement", query, {"_id": 0}, [("created_at", -1)], 1000, include_archive)
     for rec in records:
         if isinstance(rec.get('procurement_date'), str):
             rec['procurement_date'] = datetime.fromisoformat(rec['procurement_date'])
@@ -1268,32 +1983,39 @@ async def get_payment_summary(po_number: str, current_user: User = Depends(get_c
     if not po:
         raise HTTPException(status_code=404, detail="PO not found")
     
+    return {"po_number": po_number, **await po_payment_totals(db, po)}
+
+async def po_payment_totals(database, po: dict) -> dict:
+    po_number = po["po_number"]
     po_total = po.get("total_value", 0)
     
     # Get internal payments (include legacy payments without payment_type)
-    internal_payments = await db.payments.find({
+    internal_payments = await database.payments.find({
         "po_number": po_number,
         "$or": [
             {"payment_type": "internal"},
             {"payment_type": {"$exists": False}}  # Legacy payments without payment_type
         ]
-    }).to_list(1000)
+    }, {"_id": 0, "amount": 1}).to_list(None)
     total_internal = sum(p.get("amount", 0) for p in internal_payments)
     
     # Get external payments
-    external_payments = await db.payments.find({"po_number": po_number, "payment_type": "external"}).to_list(1000)
+    external_payments = await database.payments.find({"po_number": po_number, "payment_type": "external"}, {"_id": 0, "amount": 1}).to_list(None)
     total_external = sum(p.get("amount", 0) for p in external_payments)
     
     return {
-        "po_number": po_number,
         "po_total_value": po_total,
         "internal_paid": total_internal,
         "external_paid": total_external,
         "external_remaining": total_internal - total_external
     }
 
+def po_payments_settled(totals: dict) -> bool:
+    """Internal payments cover the PO value and external payments have passed all of it on"""
+    return totals["internal_paid"] > 0 and totals["internal_paid"] >= totals["po_total_value"] and totals["external_remaining"] <= 0
+
 @api_router.get("/payments", response_model=List[Payment])
-async def get_payments(po_number: Optional[str] = None, payment_type: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def get_payments(po_number: Optional[str] = None, payment_type: Optional[str] = None, include_archive: bool = False, current_user: User = Depends(get_current_user)):
     query = {}
     if po_number:
         query["po_number"] = po_number
@@ -1304,7 +2026,7 @@ async def get_payments(po_number: Optional[str] = None, payment_type: Optional[s
         else:
             query["payment_type"] = payment_type
     
-    payments = await db.payments.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    payments = await find_with_archive("payments", query, {"_id": 0}, [("created_at", -1)], 1000, include_archive)
     for payment in payments:
         if isinstance(payment.get('payment_date'), str):
             payment['payment_date'] = datetime.fromisoformat(payment['payment_date'])
@@ -1318,6 +2040,353 @@ async def get_payments(po_number: Optional[str] = None, payment_type: Optional[s
                 payment[field] = None
     return [Payment(**payment) for payment in payments]
 
+# ── Bank statement reconciliation ─────────────────────────────────────────────
+# The statement is streamed in chunks and each UTR is looked up in an in-memory index
+# built from one projected query per source (payment UTRs and transaction refs,
+# procurement settlement UTRs), so the cost is one pass over the file plus two scans.
+RECON_CHUNK_ROWS = 5000
+RECON_MAX_ROWS = int(os.environ.get("RECON_MAX_ROWS", 200000))
+RECON_MAX_REPORTED = 1000   # rows listed per category; counts always cover the whole file
+RECON_AMOUNT_TOLERANCE = float(os.environ.get("RECON_AMOUNT_TOLERANCE", 0.01))
+RECON_UTR_COLUMNS = ["utr", "utr_number", "utr_no", "reference", "reference_no", "ref_no", "transaction_ref"]
+RECON_AMOUNT_COLUMNS = ["amount", "debit", "debit_amount", "withdrawal", "withdrawal_amount", "credit", "credit_amount"]
+RECON_DATE_COLUMNS = ["date", "value_date", "txn_date", "transaction_date"]
+RECON_CATEGORIES = ["matched", "amount_mismatch", "unmatched", "duplicate", "invalid"]
+
+def _normalize_utr(value) -> Optional[str]:
+    if value is None:
+        return None
+    utr = str(value).strip().upper()
+    return utr or None
+
+def _parse_amount(value) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = re.sub(r"[,\s₹]", "", str(value or ""))
+    try:
+        return float(text) if text else None
+    except ValueError:
+        return None
+
+async def build_utr_index() -> Dict[str, List[dict]]:
+    """UTR -> the payments and settled procurement records carrying it"""
+    payments, settlements = await asyncio.gather(
+        db.payments.find(
+            {"$or": [{"utr_number": {"$nin": [None, ""]}}, {"transaction_ref": {"$nin": [None, ""]}}]},
+            {"_id": 0, "payment_id": 1, "po_number": 1, "amount": 1, "utr_number": 1, "transaction_ref": 1}
+        ).to_list(None),
+        db.procurement.find(
+            {"settlement_utr": {"$nin": [None, ""]}},
+            {"_id": 0, "procurement_id": 1, "po_number": 1, "settlement_amount": 1, "settlement_utr": 1}
+        ).to_list(None),
+    )
+    index: Dict[str, List[dict]] = {}
+    for payment in payments:
+        ref = {"source": "payment", "id": payment.get("payment_id"), "po_number": payment.get("po_number"), "amount": payment.get("amount")}
+        # A payment whose UTR is also its transaction ref is indexed once
+        for utr in {_normalize_utr(payment.get("utr_number")), _normalize_utr(payment.get("transaction_ref"))} - {None}:
+            index.setdefault(utr, []).append(ref)
+    for proc in settlements:
+        ref = {"source": "settlement", "id": proc.get("procurement_id"), "po_number": proc.get("po_number"), "amount": proc.get("settlement_amount")}
+        index.setdefault(_normalize_utr(proc["settlement_utr"]), []).append(ref)
+    return index
+
+def _reconcile_rows(rows: List[tuple], columns: Dict[str, List[int]], index: Dict[str, List[dict]],
+                    seen: Dict[str, int], first_row: int, report: Dict[str, Any]):
+    """Classify one chunk of statement rows into report; `seen` carries UTR -> first row across chunks"""
+    def cell(row, names):
+        for position in columns.get(names, []):
+            if position < len(row) and row[position] not in (None, ""):
+                return row[position]
+        return None
+
+    for offset, row in enumerate(rows):
+        if not any(value not in (None, "") for value in row):
+            continue
+        line = first_row + offset
+        utr = _normalize_utr(cell(row, "utr"))
+        raw_amount = cell(row, "amount")
+        amount = _parse_amount(raw_amount)
+        entry = {"row": line, "utr": utr, "amount": amount, "date": cell(row, "date")}
+        if utr is None:
+            category, entry["reason"] = "invalid", "no UTR"
+        elif utr in seen:
+            category, entry["reason"] = "duplicate", f"UTR already on row {seen[utr]}"
+        else:
+            seen[utr] = line
+            refs = index.get(utr)
+            if amount is None:
+                category, entry["reason"] = "invalid", f"amount {raw_amount!r} is not a number"
+            elif not refs:
+                category = "unmatched"
+            elif len(refs) > 1:
+                category, entry["reason"], entry["records"] = "duplicate", "UTR is on several records", refs
+            else:
+                entry["record"] = refs[0]
+                expected = refs[0]["amount"]
+                if expected is None or abs(float(expected) - amount) > RECON_AMOUNT_TOLERANCE:
+                    category, entry["expected_amount"] = "amount_mismatch", expected
+                else:
+                    category = "matched"
+        report["counts"][category] += 1
+        if len(report[category]) < RECON_MAX_REPORTED:
+            report[category].append(entry)
+
+@api_router.post("/payments/reconcile")
+async def reconcile_bank_statement(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
+    rows = _iter_upload_rows(file)
+    header, index = await asyncio.gather(asyncio.to_thread(next, rows, None), build_utr_index())
+    if header is None:
+        raise HTTPException(status_code=400, detail="The file is empty")
+    names = [str(h).strip().lower().replace(" ", "_").replace(".", "") if h is not None else "" for h in header]
+    columns = {
+        key: [names.index(alias) for alias in aliases if alias in names]
+        for key, aliases in (("utr", RECON_UTR_COLUMNS), ("amount", RECON_AMOUNT_COLUMNS), ("date", RECON_DATE_COLUMNS))
+    }
+    missing = [key for key in ("utr", "amount") if not columns[key]]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"No {' or '.join(missing)} column in the statement header")
+
+    report: Dict[str, Any] = {category: [] for category in RECON_CATEGORIES}
+    report["counts"] = {category: 0 for category in RECON_CATEGORIES}
+    seen: Dict[str, int] = {}
+    row_count = 0
+    while True:
+        chunk = await asyncio.to_thread(lambda: list(itertools.islice(rows, RECON_CHUNK_ROWS)))
+        if not chunk:
+            break
+        if row_count + len(chunk) > RECON_MAX_ROWS:
+            raise HTTPException(status_code=400, detail=f"At most {RECON_MAX_ROWS} rows per statement")
+        await asyncio.to_thread(_reconcile_rows, chunk, columns, index, seen, row_count + 2, report)
+        row_count += len(chunk)
+
+    # Records carrying a UTR that the statement never mentioned
+    missing_from_statement = [{"utr": utr, **ref} for utr, refs in index.items() if utr not in seen for ref in refs]
+    await create_audit_log("RECONCILE", "BankStatement", file.filename or "statement", current_user,
+                           {"rows": row_count, **report["counts"]})
+    return {
+        "rows": row_count,
+        **report,
+        "not_on_statement_count": len(missing_from_statement),
+        "not_on_statement": missing_from_statement[:RECON_MAX_REPORTED],
+    }
+
+# ── Notification push (SSE) ───────────────────────────────────────────────────
+# Seconds between keep-alive comments on an idle stream (keeps proxies from closing it)
+NOTIFICATION_STREAM_HEARTBEAT = int(os.environ.get("NOTIFICATION_STREAM_HEARTBEAT", 25))
+
+def _notification_payload(doc: dict) -> dict:
+    """Client-facing shape of a notification document (ObjectId exposed as notification_id)."""
+    payload = {k: v for k, v in doc.items() if k != "_id"}
+    if doc.get("_id") is not None:
+        payload["notification_id"] = str(doc["_id"])
+    return payload
+
+def _notification_visible_to(notification: dict, user: User) -> bool:
+    if notification.get("target_user_id") == user.user_id:
+        return True
+    if notification.get("role") and notification.get("role") == user.role:
+        return True
+    return bool(notification.get("is_escalated")) and user.role in ["Manager", "Admin"]
+
+class NotificationBroker:
+    """In-process pub/sub that fans notification events out to SSE subscribers.
+
+    Request handlers publish after each write. When MongoDB runs as a replica set the
+    broker is fed from a change stream on `notifications` instead, so writes made by any
+    worker (or script) reach every connected client exactly once.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.uses_change_stream = False
+        self._subscribers: Dict[asyncio.Queue, User] = {}
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def subscribe(self, user: User) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[queue] = user
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.pop(queue, None)
+
+    def publish(self, event: str, notification: dict):
+        """Publish a write made by this process. No-op when the change stream relays writes."""
+        if not self.uses_change_stream:
+            self._dispatch(event, notification)
+
+    def _dispatch(self, event: str, notification: dict):
+        for queue, user in list(self._subscribers.items()):
+            # Removals only carry an id, so every client gets them and ignores unknown ids
+            if event != "removed" and not _notification_visible_to(notification, user):
+                continue
+            if queue.full():
+                # Slow consumer: drop its oldest event rather than buffer without bound
+                queue.get_nowait()
+            queue.put_nowait({"event": event, "notification": notification})
+
+    async def start(self, database):
+        try:
+            hello = await database.client.admin.command("hello")
+        except Exception as e:
+            logging.warning(f"Notification broker: could not detect topology ({e}); using in-process pub/sub")
+            return
+        if hello.get("setName"):
+            self.uses_change_stream = True
+            self._watch_task = asyncio.create_task(self._watch(database))
+            logging.info("Notification broker: relaying notifications from change stream")
+
+    async def stop(self):
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    async def _watch(self, database):
+        resume_token = None
+        while True:
+            try:
+                async with database.notifications.watch(full_document="updateLookup", resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        operation = change["operationType"]
+                        if operation == "delete":
+                            self._dispatch("removed", {"notification_id": str(change["documentKey"]["_id"])})
+                        elif operation in ("insert", "update", "replace") and change.get("fullDocument"):
+                            event = "created" if operation == "insert" else "updated"
+                            self._dispatch(event, _notification_payload(change["fullDocument"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Notification change stream error: {e}. Reconnecting in 5s...")
+                await asyncio.sleep(5)
+
+notification_broker = NotificationBroker()
+
+# How often overdue gap-reverse notifications are escalated (seconds)
+GAP_ESCALATION_INTERVAL = int(os.environ.get("GAP_ESCALATION_INTERVAL", 300))
+
+class GapEscalationJob(PeriodicJob):
+    """Escalates pending gap-reverse notifications once their 48h deadline passes.
+
+    A single update_many flips `is_escalated` on the indexed deadline, tagging the rows
+    with a batch id so exactly this run alerts the managers for them; later runs (or
+    other workers) no longer match those rows, so each alert is queued once.
+    """
+    name = "gap-escalation"
+
+    def __init__(self, database, broker: NotificationBroker, interval: float = GAP_ESCALATION_INTERVAL,
+                 clock: Callable[[], datetime] = utc_now, alert_sender: Optional[Callable] = None):
+        super().__init__(interval, clock)
+        self.database = database
+        self.broker = broker
+        self.alert_sender = alert_sender or send_smtp_email
+
+    async def run_once(self) -> int:
+        from uuid import uuid4
+        now = self.clock().isoformat()
+        batch_id = str(uuid4())
+        result = await self.database.notifications.update_many(
+            {
+                "type": "gap_reverse",
+                "status": "pending",
+                "is_escalated": {"$in": [False, None]},
+                "deadline": {"$lt": now},
+            },
+            [{"$set": {
+                "is_escalated": True,
+                "escalated_at": now,
+                "escalation_batch": batch_id,
+                "message": {"$concat": ["URGENT: ", "$message", " (Escalated to Manager)"]},
+            }}],
+        )
+        if not result.modified_count:
+            return 0
+
+        escalated = await self.database.notifications.find({"escalation_batch": batch_id}).to_list(None)
+        for n in escalated:
+            self.broker.publish("updated", _notification_payload(n))
+        await self._alert_managers(escalated)
+        logging.info(f"Gap escalation: escalated {len(escalated)} notification(s)")
+        return len(escalated)
+
+    async def _alert_managers(self, escalated: List[dict]):
+        managers = await self.database.users.find({"role": "Manager"}, {"_id": 0, "email": 1}).to_list(100)
+        if not managers:
+            return
+        rows = "".join(
+            f"<tr><td style='padding:8px 12px; border:1px solid #e2e8f0; font-family:monospace;'>{n.get('po_number', '')}</td>"
+            f"<td style='padding:8px 12px; border:1px solid #e2e8f0;'>{n.get('created_at', '')[:16].replace('T', ' ')} UTC</td></tr>"
+            for n in escalated
+        )
+        html_body = f"""
+        <html>
+        <body style="font-family: Arial, sans-serif; background: #f9f9f9; padding: 20px;">
+          <div style="max-width:620px; margin:0 auto; background:#fff; border-radius:8px; padding:28px 30px;">
+            <h3 style="color:#DC2626; margin-top:0;">⚠️ Procurement gaps escalated</h3>
+            <p style="color:#444;">The following reverse requests were not resolved within 48 hours.</p>
+            <table style="border-collapse:collapse; width:100%; font-size:14px;">
+              <tr><th style="text-align:left; padding:8px 12px;">PO Number</th><th style="text-align:left; padding:8px 12px;">Raised At</th></tr>
+              {rows}
+            </table>
+          </div>
+        </body>
+        </html>
+        """
+        for manager in managers:
+            if manager.get("email"):
+                await self.alert_sender(manager["email"], f"Escalation: {len(escalated)} procurement gap(s) unresolved", html_body)
+
+gap_escalation_job = GapEscalationJob(db, notification_broker)
+optional_security = HTTPBearer(auto_error=False)
+
+@api_router.get("/notifications/stream")
+async def stream_notifications(
+    request: Request,
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+):
+    """Server-Sent Events feed of notification changes (`created`, `updated`, `removed`).
+
+    EventSource cannot set headers, so the JWT may also be passed as `?token=`.
+    Clients load the initial list from GET /notifications and then apply these events.
+    """
+    if credentials:
+        current_user = await get_user_from_token(credentials.credentials)
+    elif token:
+        current_user = await get_user_from_token(token)
+    else:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    queue = notification_broker.subscribe(current_user)
+
+    async def event_source():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=NOTIFICATION_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                data = json.dumps(message["notification"], default=str)
+                yield f"event: {message['event']}\ndata: {data}\n\n"
+        finally:
+            notification_broker.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+# ────────────────────────────────────────────────────────────────────────────────
+
 @api_router.get("/notifications")
 async def get_notifications(current_user: User = Depends(get_current_user)):
     # Find notifications for this user or their role
@@ -1328,107 +2397,454 @@ async def get_notifications(current_user: User = Depends(get_current_user)):
         ]
     }
     
-    # Also include Manager notifications for escalated issues
+    # Also include Manager notifications for escalated issues (flagged by GapEscalationJob)
     if current_user.role in ["Manager", "Admin"]:
-        # Find escalated notifications (older than 48h)
-        escalated_query = {
-            "type": "gap_reverse",
-            "status": "pending",
-            "created_at": {"$lt": (datetime.now(timezone.utc) - timedelta(hours=48)).isoformat()}
-        }
-        query["$or"].append(escalated_query)
-
-    notifications = await db.notifications.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
-    
-    # Process notifications for escalation
-    for n in notifications:
-        if n.get("type") == "gap_reverse" and n.get("status") == "pending":
-            created_at = datetime.fromisoformat(n["created_at"])
-            if (datetime.now(timezone.utc) - created_at).total_seconds() > 48 * 3600:
-                n["is_escalated"] = True
-                n["message"] = f"URGENT: {n['message']} (Escalated to Manager)"
-                
-    return notifications
-@api_router.get("/inventory/lookup/{imei}")
-async def lookup_imei(imei: str, current_user: User = Depends(get_current_user)):
-    """Lookup IMEI details - always returns found: true to allow any IMEI without procurement linking"""
-    # First check if IMEI exists in inventory
-    inventory_record = await db.imei_inventory.find_one({"imei": imei}, {"_id": 0})
-    
-    # Then check procurement records for this IMEI
-    procurement_record = await db.procurement.find_one({"imei": imei}, {"_id": 0})
-    
-    # Also check PO items for this IMEI to get brand, model, color
-    po_item_data = None
-    if procurement_record and procurement_record.get("po_number"):
-        po = await db.purchase_orders.find_one({"po_number": procurement_record.get("po_number")}, {"_id": 0})
-        if po and po.get("items"):
-            for item in po["items"]:
-                if item.get("imei") == imei or item.get("vendor") == procurement_record.get("vendor_name"):
-                    po_item_data = item
-                    break
-            # If no exact match, use first item with same vendor
-            if not po_item_data:
-                po_item_data = po["items"][0] if po["items"] else None
-    
-    # Always return found: true - allow any IMEI without requiring procurement linking
-    result = {
-        "found": True,
+        query["$or"].append({"type": "gap_reverse", "status": "pending", "is_escalated": True})
+
+    notifications = await db.notifications.find(query).sort("created_at", -1).to_list(100)
+    return [_notification_payload(n) for n in notifications]
+# ── IMEI catalog (denormalized lookup view) ───────────────────────────────────
+# One document per IMEI holding the merged inventory / procurement / PO-item view that
+# lookup_imei returns, so a scanner lookup is a single indexed read. It is kept current
+# by the procurement, scan, reservation and delete paths.
+from pymongo import ReplaceOne, DeleteOne, UpdateOne, UpdateMany
+
+IMEI_CATALOG_CHUNK = 1000
+
+def _match_po_item(items: List[dict], imei: str, vendor_name: Optional[str]) -> Optional[dict]:
+    """PO line item for an IMEI: exact IMEI or vendor match, else the first item."""
+    for item in items:
+        if item.get("imei") == imei or item.get("vendor") == vendor_name:
+            return item
+    return items[0] if items else None
+
+# PO line items are also stored one document per line in `po_items` (po_number, line,
+# item fields) so enrichment can fetch the one matching line through an index instead
+# of loading the whole PO and scanning its items array.
+async def index_po_items(po_number: str, items: List[dict]):
+    if items:
+        await db.po_items.insert_many([{"po_number": po_number, "line": i, **item} for i, item in enumerate(items)])
+
+async def find_po_item(po_number: str, imei: str, vendor_name: Optional[str]) -> Optional[dict]:
+    """Same choice as _match_po_item over the PO's items, reading at most one line per query."""
+    projection = {"_id": 0, "po_number": 0, "line": 0}
+    item = await db.po_items.find_one(
+        {"po_number": po_number, "$or": [{"imei": imei}, {"vendor": vendor_name}]}, projection, sort=[("line", 1)]
+    )
+    if item is None:
+        item = await db.po_items.find_one({"po_number": po_number}, projection, sort=[("line", 1)])
+    return item
+
+async def rebuild_po_items():
+    """Backfill po_items from the embedded items of every PO (first deploy)."""
+    async for po in db.purchase_orders.find({}, {"_id": 0, "po_number": 1, "items": 1}):
+        await db.po_items.delete_many({"po_number": po["po_number"]})
+        await index_po_items(po["po_number"], po.get("items", []))
+    logging.info("PO item index rebuilt")
+
+def _catalog_inventory_fields(inventory_record: dict) -> dict:
+    """Catalog fields taken from the inventory record; these win over procurement / PO values."""
+    fields = {
+        "in_inventory": True,
+        "status": inventory_record.get("status"),
+        "current_location": inventory_record.get("current_location"),
+        "organization": inventory_record.get("organization"),
+        "device_model": inventory_record.get("device_model"),
+        "vendor": inventory_record.get("vendor"),
+    }
+    for key in ["brand", "model", "colour"]:
+        if inventory_record.get(key):
+            fields[key] = inventory_record[key]
+    return fields
+
+def build_imei_catalog_entry(imei: str, inventory_record: Optional[dict], procurement_record: Optional[dict],
+                             po_item_data: Optional[dict]) -> dict:
+    entry = {
+        "imei": imei,
         "in_inventory": inventory_record is not None,
         "in_procurement": procurement_record is not None,
     }
     
     # If in procurement, get vendor details
     if procurement_record:
-        result["vendor"] = procurement_record.get("vendor_name")
-        result["device_model"] = procurement_record.get("device_model")
-        result["po_number"] = procurement_record.get("po_number")
-        result["store_location"] = procurement_record.get("store_location")
-        result["purchase_price"] = procurement_record.get("purchase_price")
-        result["procurement_date"] = procurement_record.get("procurement_date")
+        entry["vendor"] = procurement_record.get("vendor_name")
+        entry["device_model"] = procurement_record.get("device_model")
+        entry["po_number"] = procurement_record.get("po_number")
+        entry["store_location"] = procurement_record.get("store_location")
+        entry["purchase_price"] = procurement_record.get("purchase_price")
+        entry["procurement_date"] = procurement_record.get("procurement_date")
     
     # If we found PO item data, get brand, model, color
     if po_item_data:
-        result["brand"] = po_item_data.get("brand")
-        result["model"] = po_item_data.get("model")
-        result["colour"] = po_item_data.get("colour")
-        result["storage"] = po_item_data.get("storage")
+        entry["brand"] = po_item_data.get("brand")
+        entry["model"] = po_item_data.get("model")
+        entry["colour"] = po_item_data.get("colour")
+        entry["storage"] = po_item_data.get("storage")
         # Also use vendor and location from PO item if available
         if po_item_data.get("vendor"):
-            result["vendor"] = po_item_data.get("vendor")
+            entry["vendor"] = po_item_data.get("vendor")
         if po_item_data.get("location"):
-            result["store_location"] = po_item_data.get("location")
+            entry["store_location"] = po_item_data.get("location")
     
-    # If in inventory, get current status
+    # If in inventory, current status wins
     if inventory_record:
-        result["status"] = inventory_record.get("status")
-        result["current_location"] = inventory_record.get("current_location")
-        result["organization"] = inventory_record.get("organization")
-        result["device_model"] = inventory_record.get("device_model")
-        result["vendor"] = inventory_record.get("vendor")
-        result["brand"] = inventory_record.get("brand") or result.get("brand")
-        result["model"] = inventory_record.get("model") or result.get("model")
-        result["colour"] = inventory_record.get("colour") or result.get("colour")
+        entry.update(_catalog_inventory_fields(inventory_record))
     
-    return result
+    return entry
+
+async def load_po_item_candidates(procurement: Dict[str, dict], imeis: List[str], include_archive: bool = False) -> Dict[str, List[dict]]:
+    """PO lines that _match_po_item could pick for these procurement records, in one $in read.
+
+    Only the lines matching some IMEI/vendor, plus each PO's first line; grouped by po_number.
+    """
+    po_numbers = list({p["po_number"] for p in procurement.values() if p.get("po_number")})
+    po_items: Dict[str, List[dict]] = {}
+    if not po_numbers:
+        return po_items
+    vendors = list({p.get("vendor_name") for p in procurement.values()})
+    candidates = await find_with_archive(
+        "po_items",
+        {"po_number": {"$in": po_numbers}, "$or": [{"imei": {"$in": imeis}}, {"vendor": {"$in": vendors}}, {"line": 0}]},
+        {"_id": 0}, [("po_number", 1), ("line", 1)], None, include_archive
+    )
+    for item in candidates:
+        po_items.setdefault(item.pop("po_number"), []).append(item)
+    for items in po_items.values():
+        for item in items:
+            item.pop("line")
+    return po_items
+
+async def refresh_imei_catalog(imeis: List[str]):
+    """Rebuild catalog entries for `imeis` from the source collections ($in reads, one bulk write)."""
+    imeis = list(dict.fromkeys(i for i in imeis if i))
+    for start in range(0, len(imeis), IMEI_CATALOG_CHUNK):
+        chunk = imeis[start:start + IMEI_CATALOG_CHUNK]
+        inventory = {d["imei"]: d for d in await db.imei_inventory.find({"imei": {"$in": chunk}}, {"_id": 0}).to_list(None)}
+        procurement = {}
+        # Archived POs keep their units' catalog entries complete
+        for d in await find_with_archive("procurement", {"imei": {"$in": chunk}}, {"_id": 0}, [("created_at", 1)], None, True):
+            procurement.setdefault(d["imei"], d)
+        po_items = await load_po_item_candidates(procurement, chunk, include_archive=True)
+
+        ops = []
+        for imei in chunk:
+            inventory_record, procurement_record = inventory.get(imei), procurement.get(imei)
+            if not inventory_record and not procurement_record:
+                ops.append(DeleteOne({"imei": imei}))
+                continue
+            po_item_data = None
+            if procurement_record and procurement_record.get("po_number"):
+                po_item_data = _match_po_item(po_items.get(procurement_record["po_number"], []), imei, procurement_record.get("vendor_name"))
+            ops.append(ReplaceOne({"imei": imei}, build_imei_catalog_entry(imei, inventory_record, procurement_record, po_item_data), upsert=True))
+        await db.imei_catalog.bulk_write(ops, ordered=False)
+
+async def rebuild_imei_catalog():
+    """Backfill the catalog from every IMEI in inventory and procurement, chunk by chunk."""
+    for collection in [db.imei_inventory, db.procurement]:
+        chunk = []
+        async for doc in collection.find({"imei": {"$ne": None}}, {"_id": 0, "imei": 1}):
+            chunk.append(doc["imei"])
+            if len(chunk) >= IMEI_CATALOG_CHUNK:
+                await refresh_imei_catalog(chunk)
+                chunk = []
+        await refresh_imei_catalog(chunk)
+    logging.info("IMEI catalog rebuilt")
+
+async def ensure_imei_catalog():
+    """Backfill once when the catalog is empty but inventory / procurement are not (first deploy)."""
+    if await db.po_items.estimated_document_count() == 0 and await db.purchase_orders.estimated_document_count():
+        await rebuild_po_items()
+    if await db.imei_catalog.estimated_document_count() == 0 and (
+        await db.imei_inventory.estimated_document_count() or await db.procurement.estimated_document_count()
+    ):
+        await rebuild_imei_catalog()
+# ────────────────────────────────────────────────────────────────────────────────
+
+# Max IMEIs per POST /inventory/lookup request (a full pallet is a few hundred)
+IMEI_BATCH_LOOKUP_MAX = int(os.environ.get("IMEI_BATCH_LOOKUP_MAX", 5000))
+
+class IMEIBatchLookup(BaseModel):
+    imeis: List[str]
+
+@api_router.post("/inventory/lookup")
+async def batch_lookup_imeis(request: IMEIBatchLookup, current_user: User = Depends(get_current_user)):
+    """Pre-validate a pallet of IMEIs in one call (up to IMEI_BATCH_LOOKUP_MAX).
+
+    Results follow input order. Unlike the single lookup, `found` is false for IMEIs
+    that are in neither inventory nor procurement, so clients can flag them.
+    """
+    if len(request.imeis) > IMEI_BATCH_LOOKUP_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {IMEI_BATCH_LOOKUP_MAX} IMEIs per request")
+    imeis = [i.strip() for i in request.imeis]
+    unique = list(dict.fromkeys(i for i in imeis if i))
+    chunks = [unique[i:i + IMEI_CATALOG_CHUNK] for i in range(0, len(unique), IMEI_CATALOG_CHUNK)]
+    found = await asyncio.gather(*[
+        db.imei_catalog.find({"imei": {"$in": chunk}}, {"_id": 0}).to_list(None) for chunk in chunks
+    ])
+    catalog = {entry["imei"]: entry for entries in found for entry in entries}
+
+    results = []
+    for imei in imeis:
+        entry = catalog.get(imei)
+        results.append({"imei": imei, "found": True, **entry} if entry else
+                       {"imei": imei, "found": False, "in_inventory": False, "in_procurement": False})
+    found_count = sum(1 for r in results if r["found"])
+    return {"results": results, "found": found_count, "missing": len(results) - found_count}
+
+@api_router.get("/inventory/lookup/{imei}")
+async def lookup_imei(imei: str, current_user: User = Depends(get_current_user)):
+    """Lookup IMEI details - always returns found: true to allow any IMEI without procurement linking"""
+    entry = await db.imei_catalog.find_one({"imei": imei}, {"_id": 0, "imei": 0})
+    # Always return found: true - allow any IMEI without requiring procurement linking
+    return {"found": True, **(entry or {"in_inventory": False, "in_procurement": False})}
+
+# ── Scan de-duplication ───────────────────────────────────────────────────────
+# Retried submissions (scanner double-fires, flaky Wi-Fi) are acknowledged without
+# touching inventory or writing another audit entry.
+SCAN_DEDUP_WINDOW_SECONDS = int(os.environ.get("SCAN_DEDUP_WINDOW_SECONDS", 120))
+
+class ScanDeduplicator:
+    """Short-lived idempotency keys: an in-process map in front of a Mongo collection.
+
+    The Mongo side (`_id` = key, TTL index on `created_at`) makes the window hold across
+    workers; the local map answers repeats from the same station without a round trip.
+    MongoDB's TTL monitor runs about once a minute, so keys can outlive the window by
+    that much.
+    """
+
+    def __init__(self, collection, window_seconds: int = SCAN_DEDUP_WINDOW_SECONDS, clock: Callable[[], datetime] = utc_now):
+        self.collection = collection
+        self.window = timedelta(seconds=window_seconds)
+        self.clock = clock
+        self._seen: Dict[str, datetime] = {}
+        self._next_purge = clock()
+
+    def key_for(self, scan_data: IMEIScan) -> str:
+        """Client-supplied key, else IMEI + action + location + current minute."""
+        if scan_data.idempotency_key:
+            return f"key:{scan_data.idempotency_key}"
+        return f"scan:{scan_data.imei}|{scan_data.action}|{scan_data.location}|{self.clock():%Y%m%d%H%M}"
+
+    async def claim(self, keys: List[str]) -> List[bool]:
+        """Claim keys in order; True where this is the first submission inside the window."""
+        now = self.clock()
+        if now >= self._next_purge:
+            self._seen = {k: expiry for k, expiry in self._seen.items() if expiry > now}
+            self._next_purge = now + self.window
+
+        claimed, fresh = [], {}
+        for i, key in enumerate(keys):
+            expiry = self._seen.get(key)
+            first = (expiry is None or expiry <= now) and key not in fresh
+            claimed.append(first)
+            if first:
+                fresh[key] = i
+        if fresh:
+            try:
+                # created_at is a BSON date (not an ISO string) so the TTL index can expire it
+                await self.collection.insert_many([{"_id": key, "created_at": now} for key in fresh], ordered=False)
+            except BulkWriteError as e:
+                keys_in_order = list(fresh)
+                for err in e.details.get("writeErrors", []):
+                    if err.get("code") != 11000:
+                        raise
+                    claimed[fresh[keys_in_order[err["index"]]]] = False
+        for key in fresh:
+            self._seen[key] = now + self.window
+        return claimed
+
+    def clear(self):
+        self._seen.clear()
+
+    async def release(self, keys: List[str]):
+        """Forget keys whose scan failed, so the client's retry is applied."""
+        if not keys:
+            return
+        for key in keys:
+            self._seen.pop(key, None)
+        await self.collection.delete_many({"_id": {"$in": keys}})
+
+scan_dedup = ScanDeduplicator(db.scan_dedup)
+# ────────────────────────────────────────────────────────────────────────────────
+
+VALID_SCAN_ACTIONS = ["inward_nova", "inward_magnova", "outward_nova", "outward_magnova", "dispatch", "available"]
+
+def _validate_scan(scan_data: IMEIScan):
+    # Validate required fields
+    if not scan_data.imei or not scan_data.imei.strip():
+        raise HTTPException(status_code=400, detail="IMEI is required")
+    if not scan_data.action or not scan_data.action.strip():
+        raise HTTPException(status_code=400, detail="Action is required")
+    if not scan_data.location or not scan_data.location.strip():
+        raise HTTPException(status_code=400, detail="Location is required")
+    
+    # Valid actions
+    if scan_data.action not in VALID_SCAN_ACTIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid action. Must be one of: {', '.join(VALID_SCAN_ACTIONS)}")
+
+def _new_inventory_doc(scan_data: IMEIScan, procurement_record: Optional[dict], po_item_data: Optional[dict]) -> dict:
+    """Inventory entry for an IMEI scanned for the first time - allowed even without a procurement record"""
+    new_inventory = {
+        "imei": scan_data.imei,
+        "imei2": scan_data.imei2,
+        "device_model": procurement_record.get("device_model", "Unknown") if procurement_record else scan_data.model or "Unknown",
+        "status": "Procured" if procurement_record else "Available",
+        "vendor": (procurement_record.get("vendor_name") if procurement_record else None) or scan_data.vendor or "Unknown",
+        "organization": scan_data.organization or "Nova",
+        "current_location": scan_data.location or (procurement_record.get("store_location") if procurement_record else ""),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    
+    # Add procurement data if available
+    if procurement_record:
+        new_inventory["po_number"] = procurement_record.get("po_number")
+        new_inventory["procurement_id"] = procurement_record.get("procurement_id")
+        new_inventory["purchase_price"] = procurement_record.get("purchase_price")
+    
+    # Add brand, model, color from PO item data
+    if po_item_data:
+        new_inventory["brand"] = scan_data.brand or po_item_data.get("brand")
+        new_inventory["model"] = scan_data.model or po_item_data.get("model")
+        new_inventory["colour"] = scan_data.colour or po_item_data.get("colour")
+        new_inventory["storage"] = scan_data.storage or po_item_data.get("storage")
+    else:
+        new_inventory["brand"] = scan_data.brand
+        new_inventory["model"] = scan_data.model
+        new_inventory["colour"] = scan_data.colour
+        new_inventory["storage"] = scan_data.storage
+    return new_inventory
+
+def _scan_update_data(scan_data: IMEIScan) -> dict:
+    update_data = {
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "current_location": scan_data.location,
+    }
+    
+    # Add imei2 if provided
+    if scan_data.imei2:
+        update_data["imei2"] = scan_data.imei2
+        
+    # Add vendor if provided
+    if scan_data.vendor and scan_data.vendor.strip():
+        update_data["vendor"] = scan_data.vendor
+    
+    # Add brand, model, colour, storage if provided
+    if scan_data.brand and scan_data.brand.strip():
+        update_data["brand"] = scan_data.brand
+    if scan_data.model and scan_data.model.strip():
+        update_data["model"] = scan_data.model
+    if scan_data.colour and scan_data.colour.strip():
+        update_data["colour"] = scan_data.colour
+    if scan_data.storage and scan_data.storage.strip():
+        update_data["storage"] = scan_data.storage
+    
+    # Use custom inward date if provided, otherwise now
+    custom_date = scan_data.inward_date.isoformat() if scan_data.inward_date else datetime.now(timezone.utc).isoformat()
+    
+    # Set status based on action
+    if scan_data.action == "inward_nova":
+        update_data["status"] = "Inward Nova"
+        update_data["inward_nova_date"] = custom_date
+    elif scan_data.action == "inward_magnova":
+        update_data["status"] = "Inward Magnova"
+        update_data["inward_magnova_date"] = custom_date
+        update_data["organization"] = "Magnova"
+    elif scan_data.action == "outward_nova":
+        update_data["status"] = "Outward Nova"
+        update_data["outward_nova_date"] = custom_date
+    elif scan_data.action == "outward_magnova":
+        update_data["status"] = "Outward Magnova"
+        update_data["outward_magnova_date"] = custom_date
+    elif scan_data.action == "dispatch":
+        update_data["status"] = "Dispatched"
+        update_data["dispatched_date"] = custom_date
+    elif scan_data.action == "available":
+        update_data["status"] = "Available"
+    return update_data
+
+def _scan_audit_details(scan_data: IMEIScan) -> dict:
+    return {
+        "action": scan_data.action, 
+        "location": scan_data.location, 
+        "vendor": scan_data.vendor or "N/A"
+    }
+
+# ── IMEI movement history ─────────────────────────────────────────────────────
+# imei_events is append-only: every status/location change writes one event next to
+# the inventory update (insert_many per batch), so a unit's journey and a location's
+# throughput are index range scans instead of audit-log searches.
+def imei_event(imei: str, event: str, previous: Optional[dict], update_data: dict, user: Optional[User],
+               source: str, reference: Optional[str] = None) -> dict:
+    """One movement event; `previous` is the inventory record before the change (None if it was just created)."""
+    previous = previous or {}
+    return {
+        "imei": imei,
+        "event": event,
+        "source": source,
+        "reference": reference,
+        "from_status": previous.get("status"),
+        "status": update_data.get("status", previous.get("status")),
+        "from_location": previous.get("current_location"),
+        "location": update_data.get("current_location", previous.get("current_location")),
+        "organization": update_data.get("organization", previous.get("organization")),
+        "user_id": user.user_id if user else None,
+        "user_name": user.name if user else None,
+        "timestamp": update_data.get("updated_at") or datetime.now(timezone.utc).isoformat(),
+    }
+
+async def record_imei_events(events: List[dict]):
+    if events:
+        await db.imei_events.insert_many(events, ordered=True)
+
+@api_router.get("/inventory/events")
+async def get_location_events(
+    location: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 500,
+    current_user: User = Depends(get_current_user),
+):
+    """Movements into a location over a time range, newest first, with per-status counts"""
+    query: Dict[str, Any] = {"location": location}
+    window = {}
+    if since:
+        window["$gte"] = since.astimezone(timezone.utc).isoformat()
+    if until:
+        window["$lt"] = until.astimezone(timezone.utc).isoformat()
+    if window:
+        query["timestamp"] = window
+    limit = max(1, min(limit, 5000))
+    events = await db.imei_events.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+    counts = {row["_id"]: row["count"] async for row in db.imei_events.aggregate([
+        {"$match": query}, {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ])}
+    return {"location": location, "counts": counts, "total": sum(counts.values()), "events": events}
+
+@api_router.get("/inventory/{imei}/timeline")
+async def get_imei_timeline(imei: str, after: Optional[str] = None, limit: int = 500, current_user: User = Depends(get_current_user)):
+    """Every recorded movement of one IMEI, oldest first; pass the last timestamp as `after` for the next page"""
+    query: Dict[str, Any] = {"imei": imei}
+    if after:
+        query["timestamp"] = {"$gt": after}
+    limit = max(1, min(limit, 5000))
+    events = await db.imei_events.find(query, {"_id": 0}).sort("timestamp", 1).limit(limit).to_list(limit)
+    return {"imei": imei, "events": events, "next_after": events[-1]["timestamp"] if len(events) == limit else None}
+# ────────────────────────────────────────────────────────────────────────────────
 
 @api_router.post("/inventory/scan")
 async def scan_imei(scan_data: IMEIScan, current_user: User = Depends(get_current_user)):
+    dedup_key = None
     try:
-        # Validate required fields
-        if not scan_data.imei or not scan_data.imei.strip():
-            raise HTTPException(status_code=400, detail="IMEI is required")
-        if not scan_data.action or not scan_data.action.strip():
-            raise HTTPException(status_code=400, detail="Action is required")
-        if not scan_data.location or not scan_data.location.strip():
-            raise HTTPException(status_code=400, detail="Location is required")
+        _validate_scan(scan_data)
         
-        # Valid actions
-        valid_actions = ["inward_nova", "inward_magnova", "outward_nova", "outward_magnova", "dispatch", "available"]
-        if scan_data.action not in valid_actions:
-            raise HTTPException(status_code=400, detail=f"Invalid action. Must be one of: {', '.join(valid_actions)}")
+        key = scan_dedup.key_for(scan_data)
+        if not (await scan_dedup.claim([key]))[0]:
+            return {"message": "Duplicate scan ignored", "duplicate": True}
+        dedup_key = key
         
         imei_record = await db.imei_inventory.find_one({"imei": scan_data.imei})
+        new_in_inventory = imei_record is None
         
         # If IMEI not in inventory, check procurement and create entry
         if not imei_record:
@@ -1437,94 +2853,13 @@ async def scan_imei(scan_data: IMEIScan, current_user: User = Depends(get_curren
             # Get PO item data for brand, model, color
             po_item_data = None
             if procurement_record and procurement_record.get("po_number"):
-                po = await db.purchase_orders.find_one({"po_number": procurement_record.get("po_number")}, {"_id": 0})
-                if po and po.get("items"):
-                    for item in po["items"]:
-                        if item.get("imei") == scan_data.imei or item.get("vendor") == procurement_record.get("vendor_name"):
-                            po_item_data = item
-                            break
-                    if not po_item_data:
-                        po_item_data = po["items"][0] if po["items"] else None
-            
-            # Create new inventory entry - allow IMEI even without procurement record
-            new_inventory = {
-                "imei": scan_data.imei,
-                "imei2": scan_data.imei2,
-                "device_model": procurement_record.get("device_model", "Unknown") if procurement_record else scan_data.model or "Unknown",
-                "status": "Procured" if procurement_record else "Available",
-                "vendor": (procurement_record.get("vendor_name") if procurement_record else None) or scan_data.vendor or "Unknown",
-                "organization": scan_data.organization or "Nova",
-                "current_location": scan_data.location or (procurement_record.get("store_location") if procurement_record else ""),
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat(),
-            }
-            
-            # Add procurement data if available
-            if procurement_record:
-                new_inventory["po_number"] = procurement_record.get("po_number")
-                new_inventory["procurement_id"] = procurement_record.get("procurement_id")
-                new_inventory["purchase_price"] = procurement_record.get("purchase_price")
-            
-            # Add brand, model, color from PO item data
-            if po_item_data:
-                new_inventory["brand"] = scan_data.brand or po_item_data.get("brand")
-                new_inventory["model"] = scan_data.model or po_item_data.get("model")
-                new_inventory["colour"] = scan_data.colour or po_item_data.get("colour")
-                new_inventory["storage"] = scan_data.storage or po_item_data.get("storage")
-            else:
-                new_inventory["brand"] = scan_data.brand
-                new_inventory["model"] = scan_data.model
-                new_inventory["colour"] = scan_data.colour
-                new_inventory["storage"] = scan_data.storage
+                po_item_data = await find_po_item(procurement_record["po_number"], scan_data.imei, procurement_record.get("vendor_name"))
             
+            new_inventory = _new_inventory_doc(scan_data, procurement_record, po_item_data)
             await db.imei_inventory.insert_one(new_inventory)
             imei_record = new_inventory
         
-        update_data = {
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-            "current_location": scan_data.location,
-        }
-        
-        # Add imei2 if provided
-        if scan_data.imei2:
-            update_data["imei2"] = scan_data.imei2
-            
-        # Add vendor if provided
-        if scan_data.vendor and scan_data.vendor.strip():
-            update_data["vendor"] = scan_data.vendor
-        
-        # Add brand, model, colour, storage if provided
-        if scan_data.brand and scan_data.brand.strip():
-            update_data["brand"] = scan_data.brand
-        if scan_data.model and scan_data.model.strip():
-            update_data["model"] = scan_data.model
-        if scan_data.colour and scan_data.colour.strip():
-            update_data["colour"] = scan_data.colour
-        if scan_data.storage and scan_data.storage.strip():
-            update_data["storage"] = scan_data.storage
-        
-        # Use custom inward date if provided, otherwise now
-        custom_date = scan_data.inward_date.isoformat() if scan_data.inward_date else datetime.now(timezone.utc).isoformat()
-        
-        # Set status based on action
-        if scan_data.action == "inward_nova":
-            update_data["status"] = "Inward Nova"
-            update_data["inward_nova_date"] = custom_date
-        elif scan_data.action == "inward_magnova":
-            update_data["status"] = "Inward Magnova"
-            update_data["inward_magnova_date"] = custom_date
-            update_data["organization"] = "Magnova"
-        elif scan_data.action == "outward_nova":
-            update_data["status"] = "Outward Nova"
-            update_data["outward_nova_date"] = custom_date
-        elif scan_data.action == "outward_magnova":
-            update_data["status"] = "Outward Magnova"
-            update_data["outward_magnova_date"] = custom_date
-        elif scan_data.action == "dispatch":
-            update_data["status"] = "Dispatched"
-            update_data["dispatched_date"] = custom_date
-        elif scan_data.action == "available":
-            update_data["status"] = "Available"
+        update_data = _scan_update_data(scan_data)
         
         # Update the inventory record
         result = await db.imei_inventory.update_one(
@@ -1532,14 +2867,22 @@ async def scan_imei(scan_data: IMEIScan, current_user: User = Depends(get_curren
             {"$set": update_data}
         )
         
+        inventory_rollups.invalidate()
         if result.matched_count == 0:
             raise HTTPException(status_code=400, detail="Failed to update IMEI record")
+        await record_imei_events([imei_event(scan_data.imei, scan_data.action, None if new_in_inventory else imei_record,
+                                             update_data, current_user, "scan")])
         
-        await create_audit_log("SCAN", "IMEI", scan_data.imei, current_user, {
-            "action": scan_data.action, 
-            "location": scan_data.location, 
-            "vendor": scan_data.vendor or "N/A"
-        })
+        if new_in_inventory:
+            await refresh_imei_catalog([scan_data.imei])
+        else:
+            await db.imei_catalog.update_one(
+                {"imei": scan_data.imei},
+                {"$set": _catalog_inventory_fields({**imei_record, **update_data}), "$setOnInsert": {"in_procurement": False}},
+                upsert=True
+            )
+        
+        await create_audit_log("SCAN", "IMEI", scan_data.imei, current_user, _scan_audit_details(scan_data))
         
         return {
             "message": "IMEI scanned successfully", 
@@ -1547,20 +2890,722 @@ async def scan_imei(scan_data: IMEIScan, current_user: User = Depends(get_curren
         }
     except Exception as e:
         logger.error(f"Error scanning IMEI: {str(e)}")
+        if dedup_key:
+            await scan_dedup.release([dedup_key])
         raise HTTPException(status_code=500, detail=str(e))
 
+async def apply_scan_batch(scans: List[IMEIScan], current_user: User) -> List[dict]:
+    """Apply a batch of scans with bulk reads and writes.
+
+    Each scan has the same effect as POST /inventory/scan; scans of the same IMEI are
+    applied in submission order. Returns one result per scan, in input order.
+    """
+    results: List[Optional[dict]] = [None] * len(scans)
+    valid = []
+    for i, scan_data in enumerate(scans):
+        try:
+            _validate_scan(scan_data)
+            valid.append((i, scan_data))
+        except HTTPException as e:
+            results[i] = {"imei": scan_data.imei, "success": False, "error": e.detail}
+    if not valid:
+        return results
+
+    keys = [scan_dedup.key_for(scan_data) for _, scan_data in valid]
+    first = await scan_dedup.claim(keys)
+    for (i, scan_data), is_first in zip(valid, first):
+        if not is_first:
+            results[i] = {"imei": scan_data.imei, "success": True, "duplicate": True, "message": "Duplicate scan ignored"}
+    keys = [key for key, is_first in zip(keys, first) if is_first]
+    valid = [entry for entry, is_first in zip(valid, first) if is_first]
+    if not valid:
+        return results
+
+    try:
+        imeis = list(dict.fromkeys(scan_data.imei for _, scan_data in valid))
+        records = {d["imei"]: d for d in await db.imei_inventory.find({"imei": {"$in": imeis}}, {"_id": 0}).to_list(None)}
+
+        # First-time IMEIs: create inventory entries (from procurement when known) in one insert
+        missing = [imei for imei in imeis if imei not in records]
+        if missing:
+            procurement = {}
+            for d in await db.procurement.find({"imei": {"$in": missing}}, {"_id": 0}).to_list(None):
+                procurement.setdefault(d["imei"], d)
+            po_items = await load_po_item_candidates(procurement, missing)
+            first_scan = {}
+            for _, scan_data in valid:
+                first_scan.setdefault(scan_data.imei, scan_data)
+            new_docs = []
+            for imei in missing:
+                procurement_record = procurement.get(imei)
+                po_item_data = None
+                if procurement_record and procurement_record.get("po_number"):
+                    po_item_data = _match_po_item(po_items.get(procurement_record["po_number"], []), imei, procurement_record.get("vendor_name"))
+                doc = _new_inventory_doc(first_scan[imei], procurement_record, po_item_data)
+                new_docs.append(doc)
+                records[imei] = dict(doc)
+            try:
+                await db.imei_inventory.insert_many(new_docs, ordered=False)
+            except BulkWriteError as e:
+                # Another station created some of them first; the updates below still apply
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+
+        updates, events = [], []
+        created = set(missing)
+        for i, scan_data in valid:
+            update_data = _scan_update_data(scan_data)
+            updates.append(UpdateOne({"imei": scan_data.imei}, {"$set": update_data}))
+            previous = None if scan_data.imei in created else dict(records[scan_data.imei])
+            created.discard(scan_data.imei)
+            events.append(imei_event(scan_data.imei, scan_data.action, previous, update_data, current_user, "scan"))
+            records[scan_data.imei].update(update_data)
+            results[i] = {"imei": scan_data.imei, "success": True, "message": "IMEI scanned successfully",
+                          "status": update_data.get("status", "Unknown")}
+        await db.imei_inventory.bulk_write(updates, ordered=True)
+        inventory_rollups.invalidate()
+        await record_imei_events(events)
+
+        await refresh_imei_catalog(missing)
+        catalog_updates = [
+            UpdateOne({"imei": imei}, {"$set": _catalog_inventory_fields(records[imei]), "$setOnInsert": {"in_procurement": False}}, upsert=True)
+            for imei in imeis if imei not in missing
+        ]
+        if catalog_updates:
+            await db.imei_catalog.bulk_write(catalog_updates, ordered=False)
+    except Exception as e:
+        logger.error(f"Error applying scan batch: {str(e)}")
+        await scan_dedup.release(keys)
+        for i, scan_data in valid:
+            results[i] = {"imei": scan_data.imei, "success": False, "error": str(e)}
+        return results
+
+    for _, scan_data in valid:
+        await create_audit_log("SCAN", "IMEI", scan_data.imei, current_user, _scan_audit_details(scan_data))
+    return results
+
 @api_router.post("/inventory/bulk-scan")
 async def bulk_scan_imeis(scan_list: List[IMEIScan], current_user: User = Depends(get_current_user)):
-    results = []
-    for scan_data in scan_list:
+    return await apply_scan_batch(scan_list, current_user)
+
+# ── Scan station channel (WebSocket) ──────────────────────────────────────────
+# A station authenticates once (?token=<JWT>) and streams scan messages (IMEIScan fields
+# plus an optional client_ref). Scans are coalesced into micro-batches, applied with
+# apply_scan_batch, and acknowledged per IMEI:
+#   -> {"imei": "...", "action": "inward_nova", "location": "...", "organization": "Nova", "client_ref": "17"}
+#   <- {"type": "ack", "results": [{"imei": "...", "client_ref": "17", "success": true, "status": "Inward Nova"}]}
+#   <- {"type": "error", "error": "Invalid JSON"}   (for a frame that is not JSON)
+SCAN_BATCH_SIZE = int(os.environ.get("SCAN_BATCH_SIZE", 100))
+SCAN_BATCH_WINDOW_MS = int(os.environ.get("SCAN_BATCH_WINDOW_MS", 50))
+# Unprocessed scans buffered per station before the socket stops being read
+SCAN_STATION_MAX_PENDING = int(os.environ.get("SCAN_STATION_MAX_PENDING", 2000))
+# Queued in place of a frame that did not parse; answered with a {"type": "error"} frame
+INVALID_JSON_FRAME = object()
+
+async def _process_station_messages(messages: List[dict], current_user: User) -> List[dict]:
+    results: List[Optional[dict]] = [None] * len(messages)
+    scans, positions = [], []
+    for i, message in enumerate(messages):
         try:
-            res = await scan_imei(scan_data, current_user)
-            results.append({"imei": scan_data.imei, "success": True, "message": res["message"]})
-        except HTTPException as e:
-            results.append({"imei": scan_data.imei, "success": False, "error": e.detail})
+            scans.append(IMEIScan(**message))
+            positions.append(i)
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            results[i] = {"imei": message.get("imei"), "success": False, "error": f"Invalid scan: {errors}"}
+        except TypeError:
+            results[i] = {"imei": None, "success": False, "error": "Invalid scan: expected a JSON object"}
+    for i, result in zip(positions, await apply_scan_batch(scans, current_user)):
+        results[i] = result
+    for message, result in zip(messages, results):
+        if isinstance(message, dict) and message.get("client_ref") is not None:
+            result["client_ref"] = message["client_ref"]
+    return results
+
+@api_router.websocket("/inventory/scan-station")
+async def scan_station(websocket: WebSocket, token: Optional[str] = None):
+    try:
+        current_user = await get_user_from_token(token or "")
+    except HTTPException:
+        await websocket.close(code=4401)
+        return
+    await websocket.accept()
+    await websocket.send_json({"type": "ready", "batch_size": SCAN_BATCH_SIZE, "window_ms": SCAN_BATCH_WINDOW_MS})
+
+    inbox: asyncio.Queue = asyncio.Queue(maxsize=SCAN_STATION_MAX_PENDING)
+
+    async def receive_scans():
+        try:
+            while True:
+                text = await websocket.receive_text()
+                try:
+                    message = json.loads(text)
+                except ValueError:
+                    message = INVALID_JSON_FRAME
+                await inbox.put(message)
+        except WebSocketDisconnect:
+            pass
+        except Exception:
+            logger.exception(f"Scan station receive failed for {current_user.user_id}")
+            try:
+                await websocket.close(code=1011)
+            except RuntimeError:
+                pass  # already closed
+        finally:
+            await inbox.put(None)  # end-of-stream marker
+
+    receiver = asyncio.create_task(receive_scans())
+    loop = asyncio.get_running_loop()
+    try:
+        closed = False
+        while not closed:
+            first = await inbox.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = loop.time() + SCAN_BATCH_WINDOW_MS / 1000
+            while len(batch) < SCAN_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(inbox.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if message is None:
+                    closed = True
+                    break
+                batch.append(message)
+            scans = [message for message in batch if message is not INVALID_JSON_FRAME]
+            try:
+                # Frames that are not JSON have no IMEI or client_ref to acknowledge
+                for _ in range(len(batch) - len(scans)):
+                    await websocket.send_json({"type": "error", "error": "Invalid JSON"})
+                if scans:
+                    results = await _process_station_messages(scans, current_user)
+                    await websocket.send_json({"type": "ack", "results": results})
+            except (WebSocketDisconnect, RuntimeError):
+                break
+    finally:
+        receiver.cancel()
+# ────────────────────────────────────────────────────────────────────────────────
+
+# ── Inventory rollups ─────────────────────────────────────────────────────────
+# Aggregations are computed in MongoDB and cached in-process per filter. Writes to
+# imei_inventory in this process call inventory_rollups.invalidate(); the TTL bounds
+# how stale a cache can get when another worker did the write.
+STOCK_LEVEL_CACHE_SECONDS = int(os.environ.get("STOCK_LEVEL_CACHE_SECONDS", 300))
+
+class RollupCache:
+    """Per-key cache of computed results, dropped wholesale on invalidate()."""
+
+    def __init__(self, ttl_seconds: int, clock: Callable[[], datetime] = utc_now):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.clock = clock
+        self.generation = 0
+        self._entries: Dict[Any, Tuple[int, datetime, Any]] = {}
+        self._inflight: Dict[Any, asyncio.Future] = {}
+
+    def invalidate(self):
+        self.generation += 1
+        self._entries.clear()
+
+    async def get(self, key, compute: Callable[[], Any]):
+        entry = self._entries.get(key)
+        if entry and entry[0] == self.generation and entry[1] > self.clock():
+            return entry[2]
+        # Concurrent requests for the same key share one computation
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+        generation = self.generation
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
         except Exception as e:
-            results.append({"imei": scan_data.imei, "success": False, "error": str(e)})
-    return results    
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        else:
+            future.set_result(value)
+            if generation == self.generation:
+                self._entries[key] = (generation, self.clock() + self.ttl, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+inventory_rollups = RollupCache(STOCK_LEVEL_CACHE_SECONDS)
+
+# API name -> imei_inventory field
+STOCK_LEVEL_DIMENSIONS = {
+    "brand": "brand",
+    "model": "model",
+    "storage": "storage",
+    "colour": "colour",
+    "location": "current_location",
+    "status": "status",
+    "organization": "organization",
+}
+
+# Units created before brand/model were copied from the PO line only have device_model
+STOCK_LEVEL_GROUP_KEYS = {"model": {"$ifNull": ["$model", "$device_model"]}}
+
+@api_router.get("/inventory/stock-levels")
+async def get_stock_levels(
+    group_by: str = "brand,model",
+    brand: Optional[str] = None,
+    model: Optional[str] = None,
+    storage: Optional[str] = None,
+    colour: Optional[str] = None,
+    location: Optional[str] = None,
+    unit_status: Optional[str] = Query(None, alias="status"),
+    organization: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+):
+    dimensions = [d.strip() for d in group_by.split(",") if d.strip()]
+    unknown = [d for d in dimensions if d not in STOCK_LEVEL_DIMENSIONS]
+    if unknown or not dimensions:
+        raise HTTPException(status_code=400, detail=f"group_by must be a comma-separated subset of {', '.join(STOCK_LEVEL_DIMENSIONS)}")
+    dimensions = list(dict.fromkeys(dimensions))
+    filters = {"brand": brand, "model": model, "storage": storage, "colour": colour,
+               "location": location, "status": unit_status, "organization": organization}
+    match = {STOCK_LEVEL_DIMENSIONS[k]: v for k, v in filters.items() if v is not None}
+
+    async def compute():
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {d: STOCK_LEVEL_GROUP_KEYS.get(d, f"${STOCK_LEVEL_DIMENSIONS[d]}") for d in dimensions},
+                "count": {"$sum": 1},
+                "purchase_value": {"$sum": {"$ifNull": ["$purchase_price", 0]}},
+            }},
+            {"$sort": {"count": -1}},
+        ]
+        levels = []
+        async for row in db.imei_inventory.aggregate(pipeline):
+            levels.append({**{d: row["_id"].get(d) for d in dimensions}, "count": row["count"], "purchase_value": row["purchase_value"]})
+        return {
+            "group_by": dimensions,
+            "filters": {k: v for k, v in filters.items() if v is not None},
+            "levels": levels,
+            "total_units": sum(level["count"] for level in levels),
+            "total_purchase_value": sum(level["purchase_value"] for level in levels),
+            "computed_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    key = ("stock-levels", tuple(dimensions), tuple(sorted(match.items())))
+    return await inventory_rollups.get(key, compute)
+# ────────────────────────────────────────────────────────────────────────────────
+
+# ── Inventory aging ───────────────────────────────────────────────────────────
+# Days in stock run from the first inward scan (Nova, else Magnova, else record
+# creation) for units still on hand. Each day's result per filter is stored in
+# inventory_aging_snapshots, so repeat views are a single find and past days remain
+# available for trend reporting.
+AGING_BUCKETS = [(0, "0-7"), (8, "8-30"), (31, "31-90"), (91, "90+")]
+
+def _aging_pipeline(match: dict, as_of: datetime) -> List[dict]:
+    def as_date(field):
+        return {"$convert": {"input": f"${field}", "to": "date", "onError": None, "onNull": None}}
+
+    labels = {"$switch": {
+        "branches": [{"case": {"$lt": ["$age_days", AGING_BUCKETS[i + 1][0]]}, "then": label}
+                     for i, (_, label) in enumerate(AGING_BUCKETS[:-1])],
+        "default": AGING_BUCKETS[-1][1],
+    }}
+    return [
+        {"$match": {**match, "status": {"$nin": OFF_HAND_STATUSES}}},
+        {"$project": {
+            "_id": 0, "current_location": 1, "model": 1, "device_model": 1, "purchase_price": 1,
+            "stocked_at": {"$ifNull": [as_date("inward_nova_date"), {"$ifNull": [as_date("inward_magnova_date"), as_date("created_at")]}]},
+        }},
+        {"$match": {"stocked_at": {"$ne": None}}},
+        {"$addFields": {"age_days": {"$max": [0, {"$floor": {"$divide": [{"$subtract": [as_of, "$stocked_at"]}, 86400000]}}]}}},
+        {"$facet": {
+            "buckets": [{"$bucket": {
+                "groupBy": "$age_days",
+                "boundaries": [lower for lower, _ in AGING_BUCKETS],
+                "default": "overflow",
+                "output": {"count": {"$sum": 1}, "purchase_value": {"$sum": {"$ifNull": ["$purchase_price", 0]}}, "oldest_days": {"$max": "$age_days"}},
+            }}],
+            "by_location_model": [
+                {"$group": {"_id": {"location": "$current_location", "model": {"$ifNull": ["$model", "$device_model"]}, "bucket": labels},
+                            "count": {"$sum": 1}, "oldest_days": {"$max": "$age_days"}}},
+                {"$sort": {"_id.location": 1, "_id.model": 1}},
+            ],
+        }},
+    ]
+
+async def compute_inventory_aging(match: dict, as_of: datetime) -> dict:
+    result = (await db.imei_inventory.aggregate(_aging_pipeline(match, as_of)).to_list(1))[0]
+    # $bucket ids are lower boundaries; anything past the last boundary lands in "overflow" (90+)
+    by_lower = {lower: label for lower, label in AGING_BUCKETS}
+    buckets = {label: {"bucket": label, "count": 0, "purchase_value": 0, "oldest_days": 0} for _, label in AGING_BUCKETS}
+    for row in result["buckets"]:
+        label = by_lower.get(row["_id"], AGING_BUCKETS[-1][1])
+        bucket = buckets[label]
+        bucket["count"] += row["count"]
+        bucket["purchase_value"] += row["purchase_value"]
+        bucket["oldest_days"] = max(bucket["oldest_days"], row["oldest_days"])
+
+    breakdown: Dict[Tuple[Any, Any], dict] = {}
+    for row in result["by_location_model"]:
+        key = (row["_id"].get("location"), row["_id"].get("model"))
+        entry = breakdown.setdefault(key, {"location": key[0], "model": key[1], "total": 0, "oldest_days": 0,
+                                           **{label: 0 for _, label in AGING_BUCKETS}})
+        entry[row["_id"]["bucket"]] += row["count"]
+        entry["total"] += row["count"]
+        entry["oldest_days"] = max(entry["oldest_days"], row["oldest_days"])
+    return {
+        "buckets": list(buckets.values()),
+        "by_location_model": list(breakdown.values()),
+        "total_units": sum(b["count"] for b in buckets.values()),
+    }
+
+@api_router.get("/inventory/aging")
+async def get_inventory_aging(
+    location: Optional[str] = None,
+    model: Optional[str] = None,
+    organization: Optional[str] = None,
+    refresh: bool = False,
+    current_user: User = Depends(get_current_user),
+):
+    filters = {"location": location, "model": model, "organization": organization}
+    match = {STOCK_LEVEL_DIMENSIONS[k]: v for k, v in filters.items() if v is not None}
+    now = datetime.now(timezone.utc)
+    snapshot_key = {"snapshot_date": now.date().isoformat(), "filter_key": json.dumps(match, sort_keys=True)}
+
+    if not refresh:
+        snapshot = await db.inventory_aging_snapshots.find_one(snapshot_key, {"_id": 0})
+        if snapshot:
+            return snapshot
+    snapshot = {
+        **snapshot_key,
+        "filters": {k: v for k, v in filters.items() if v is not None},
+        **await compute_inventory_aging(match, now),
+        "computed_at": now.isoformat(),
+    }
+    await db.inventory_aging_snapshots.replace_one(snapshot_key, snapshot, upsert=True)
+    snapshot.pop("_id", None)
+    return snapshot
+# ────────────────────────────────────────────────────────────────────────────────
+
+# ── Vendor analytics ──────────────────────────────────────────────────────────
+# Fill rate, gaps, settlement lag and price variance per vendor and model, computed
+# with pandas from two projected scans (procurement, po_items) and stored once a day
+# in vendor_analytics_snapshots. Scorecards read that snapshot. Procurement units are
+# tied to the PO line with the same (po_number, vendor, model), falling back to the
+# vendor's first line as find_po_item does; the line gives the model and the PO rate.
+VENDOR_METRIC_COLUMNS = [
+    "po_count", "ordered_qty", "received_qty", "fill_rate", "avg_gap_qty", "open_gap_qty", "open_gap_amt",
+    "settled_count", "avg_settlement_lag_days", "max_settlement_lag_days",
+    "avg_po_rate", "avg_purchase_price", "price_variance_amt", "price_variance_pct",
+]
+
+def compute_vendor_analytics(procurement: List[dict], po_items: List[dict]) -> dict:
+    import numpy as np
+    import pandas as pd
+
+    proc = pd.DataFrame(procurement, columns=[
+        "po_number", "vendor_name", "device_model", "purchase_quantity", "purchase_price",
+        "gap_qty", "gap_amt", "gap_resolved", "procurement_date", "created_at", "settlement_date",
+    ]).rename(columns={"vendor_name": "vendor"})
+    lines = pd.DataFrame(po_items, columns=["po_number", "line", "vendor", "model", "qty", "rate"])
+    if proc.empty and lines.empty:
+        return {"vendors": [], "by_vendor_model": []}
+
+    for df, numeric in ((proc, ["purchase_quantity", "purchase_price", "gap_qty", "gap_amt"]), (lines, ["qty", "rate", "line"])):
+        df[numeric] = df[numeric].apply(pd.to_numeric, errors="coerce")
+    proc["purchase_quantity"] = proc["purchase_quantity"].fillna(1)
+    lines["qty"] = lines["qty"].fillna(1)
+
+    # One row per PO line key; repeated lines for the same model are summed at a qty-weighted rate
+    keys = ["po_number", "vendor", "model"]
+    line_keys = lines.assign(rate_qty=lines["rate"] * lines["qty"], rated_qty=lines["qty"].where(lines["rate"].notna())) \
+        .groupby(keys, dropna=False).agg(ordered_qty=("qty", "sum"), rate_qty=("rate_qty", "sum"),
+                                         rated_qty=("rated_qty", "sum"), line=("line", "min")).reset_index()
+    line_keys["rate"] = line_keys["rate_qty"] / line_keys["rated_qty"].where(line_keys["rated_qty"] > 0)
+
+    # Units match their own model's line; otherwise the vendor's first line on the PO
+    exact = proc.merge(line_keys[keys + ["rate"]], left_on=["po_number", "vendor", "device_model"], right_on=keys, how="left")
+    first_line = line_keys.sort_values("line").drop_duplicates(["po_number", "vendor"])[keys + ["rate"]]
+    fallback = proc.merge(first_line, on=["po_number", "vendor"], how="left")
+    matched = exact["model"].notna()
+    proc["model"] = exact["model"].where(matched, fallback["model"]).fillna(proc["device_model"])
+    proc["rate"] = exact["rate"].where(matched, fallback["rate"])
+
+    def as_date(column):
+        return pd.to_datetime(proc[column], utc=True, errors="coerce", format="ISO8601")
+    procured = as_date("procurement_date").fillna(as_date("created_at"))
+    proc["settlement_lag_days"] = (as_date("settlement_date") - procured).dt.total_seconds() / 86400
+    proc["variance_amt"] = (proc["purchase_price"] - proc["rate"]) * proc["purchase_quantity"]
+    proc["variance_pct"] = (proc["purchase_price"] - proc["rate"]) / proc["rate"].where(proc["rate"] > 0)
+
+    # One row per PO, vendor and model: ordered from po_items, received from procurement
+    ordered = line_keys.set_index(keys)["ordered_qty"]
+    received = proc.groupby(keys, dropna=False)["purchase_quantity"].sum().rename("received_qty")
+    per_po = pd.concat([ordered, received], axis=1).fillna({"ordered_qty": 0, "received_qty": 0}).reset_index()
+    per_po["filled_qty"] = np.minimum(per_po["received_qty"], per_po["ordered_qty"])
+    per_po["gap_qty"] = (per_po["ordered_qty"] - per_po["received_qty"]).clip(lower=0)
+
+    # gap_qty/gap_amt are stored PO-wide (synced on every record), so the open gap is taken
+    # once per PO and apportioned over its lines by shortfall, else ordered, else received
+    unresolved = proc[~proc["gap_resolved"].fillna(False).astype(bool)]
+    po_gap = unresolved.groupby("po_number").agg(po_gap_qty=("gap_qty", "max"), po_gap_amt=("gap_amt", "max"))
+    per_po = per_po.merge(po_gap, left_on="po_number", right_index=True, how="left") \
+        .fillna({"po_gap_qty": 0, "po_gap_amt": 0})
+    by_po = per_po.groupby("po_number")
+    per_po["weight"] = np.select(
+        [by_po["gap_qty"].transform("sum") > 0, by_po["ordered_qty"].transform("sum") > 0],
+        [per_po["gap_qty"], per_po["ordered_qty"]], per_po["received_qty"],
+    )
+    share = per_po["weight"] / per_po.groupby("po_number")["weight"].transform("sum").where(lambda total: total > 0)
+    per_po["open_gap_qty"] = (per_po["po_gap_qty"] * share).fillna(0)
+    per_po["open_gap_amt"] = (per_po["po_gap_amt"] * share).fillna(0)
+
+    def summarize(by: List[str]) -> pd.DataFrame:
+        po_stats = per_po.groupby(by, dropna=False).agg(
+            po_count=("po_number", "nunique"),
+            ordered_qty=("ordered_qty", "sum"),
+            received_qty=("received_qty", "sum"),
+            filled_qty=("filled_qty", "sum"),
+            avg_gap_qty=("gap_qty", "mean"),
+            open_gap_qty=("open_gap_qty", "sum"),
+            open_gap_amt=("open_gap_amt", "sum"),
+        )
+        po_stats["fill_rate"] = po_stats["filled_qty"] / po_stats["ordered_qty"].where(po_stats["ordered_qty"] > 0)
+        weighted = proc.assign(
+            rate_qty=proc["rate"] * proc["purchase_quantity"],
+            rated_qty=proc["purchase_quantity"].where(proc["rate"].notna()),
+            price_qty=proc["purchase_price"] * proc["purchase_quantity"],
+        )
+        unit_stats = weighted.groupby(by, dropna=False).agg(
+            settled_count=("settlement_lag_days", "count"),
+            avg_settlement_lag_days=("settlement_lag_days", "mean"),
+            max_settlement_lag_days=("settlement_lag_days", "max"),
+            rate_qty=("rate_qty", "sum"),
+            rated_qty=("rated_qty", "sum"),
+            price_qty=("price_qty", "sum"),
+            units=("purchase_quantity", "sum"),
+            price_variance_amt=("variance_amt", "sum"),
+            price_variance_pct=("variance_pct", "mean"),
+        )
+        unit_stats["avg_po_rate"] = unit_stats["rate_qty"] / unit_stats["rated_qty"].where(unit_stats["rated_qty"] > 0)
+        unit_stats["avg_purchase_price"] = unit_stats["price_qty"] / unit_stats["units"].where(unit_stats["units"] > 0)
+        stats = po_stats.join(unit_stats, how="outer")[VENDOR_METRIC_COLUMNS]
+        counts = ["po_count", "ordered_qty", "received_qty", "settled_count"]
+        stats[counts] = stats[counts].fillna(0).astype(int)
+        return stats.reset_index()
+
+    def records(df: pd.DataFrame) -> List[dict]:
+        df = df.round(4).astype(object).where(df.notna(), None)
+        return df.to_dict("records")
+
+    by_vendor_model = summarize(["vendor", "model"]).sort_values(["vendor", "model"], na_position="last")
+    vendors = summarize(["vendor"]).sort_values(["fill_rate", "vendor"], ascending=[True, True], na_position="last")
+    return {"vendors": records(vendors), "by_vendor_model": records(by_vendor_model)}
+
+async def vendor_analytics_snapshot(refresh: bool = False) -> dict:
+    now = datetime.now(timezone.utc)
+    snapshot_key = {"snapshot_date": now.date().isoformat()}
+    if not refresh:
+        snapshot = await db.vendor_analytics_snapshots.find_one(snapshot_key, {"_id": 0})
+        if snapshot:
+            return snapshot
+    procurement, po_items = await asyncio.gather(
+        db.procurement.find({}, {
+            "_id": 0, "po_number": 1, "vendor_name": 1, "device_model": 1, "purchase_quantity": 1, "purchase_price": 1,
+            "gap_qty": 1, "gap_amt": 1, "gap_resolved": 1, "procurement_date": 1, "created_at": 1, "settlement_date": 1,
+        }).to_list(None),
+        db.po_items.find({}, {"_id": 0, "po_number": 1, "line": 1, "vendor": 1, "model": 1, "qty": 1, "rate": 1}).to_list(None),
+    )
+    snapshot = {
+        **snapshot_key,
+        **await asyncio.to_thread(compute_vendor_analytics, procurement, po_items),
+        "computed_at": now.isoformat(),
+    }
+    await db.vendor_analytics_snapshots.replace_one(snapshot_key, snapshot, upsert=True)
+    snapshot.pop("_id", None)
+    return snapshot
+
+@api_router.get("/analytics/vendors")
+async def get_vendor_analytics(refresh: bool = False, current_user: User = Depends(get_current_user)):
+    return await vendor_analytics_snapshot(refresh)
+
+@api_router.get("/analytics/vendors/{vendor_name}")
+async def get_vendor_scorecard(vendor_name: str, refresh: bool = False, current_user: User = Depends(get_current_user)):
+    snapshot = await vendor_analytics_snapshot(refresh)
+    summary = next((v for v in snapshot["vendors"] if v["vendor"] == vendor_name), None)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="No procurement or PO lines for this vendor")
+    ranked = [v["vendor"] for v in sorted(snapshot["vendors"], key=lambda v: -(v["fill_rate"] or 0))]
+    return {
+        "vendor": vendor_name,
+        "snapshot_date": snapshot["snapshot_date"],
+        "computed_at": snapshot["computed_at"],
+        "fill_rate_rank": ranked.index(vendor_name) + 1,
+        "vendor_count": len(ranked),
+        "summary": summary,
+        "models": [row for row in snapshot["by_vendor_model"] if row["vendor"] == vendor_name],
+    }
+# ────────────────────────────────────────────────────────────────────────────────
+
+# ── Stock-take sessions ───────────────────────────────────────────────────────
+# A session snapshots the units expected at one location (one indexed query) and
+# reconciles scanned IMEIs against it in memory. Scans are also appended to
+# stock_take_scans so a session survives a restart or lands on another worker.
+OFF_HAND_STATUSES = ["Dispatched", "Sold", "In Transit"]
+
+class StockTakeCreate(BaseModel):
+    location: str
+    organization: Optional[str] = None
+
+class StockTakeScanBatch(BaseModel):
+    imeis: List[str]
+
+class StockTakeSession:
+    """Expected vs counted IMEI sets for one location."""
+
+    def __init__(self, session: dict, expected: set):
+        self.session = {k: session.get(k) for k in ("session_id", "location", "organization", "status")}
+        self.location = session["location"]
+        self.expected = expected
+        self.counted: set = set()
+        self.unexpected: Dict[str, dict] = {}   # imei -> {"reason", "recorded_location", "status"}
+
+    async def add(self, imeis: List[str]) -> Tuple[dict, List[str]]:
+        """Classify a batch of scans; only IMEIs outside the expected set cost a query.
+
+        Returns the batch result and the IMEIs counted for the first time.
+        """
+        matched, duplicates, strays, fresh = 0, 0, [], []
+        for imei in (imei.strip() for imei in imeis if imei and imei.strip()):
+            if imei in self.counted:
+                duplicates += 1
+                continue
+            self.counted.add(imei)
+            fresh.append(imei)
+            if imei in self.expected:
+                matched += 1
+            else:
+                strays.append(imei)
+
+        found = {}
+        if strays:
+            async for doc in db.imei_inventory.find(
+                {"imei": {"$in": strays}}, {"_id": 0, "imei": 1, "current_location": 1, "status": 1}
+            ):
+                found[doc["imei"]] = doc
+        new_findings = []
+        for imei in strays:
+            doc = found.get(imei)
+            if doc is None:
+                finding = {"imei": imei, "reason": "unknown"}
+            elif doc.get("status") in OFF_HAND_STATUSES:
+                finding = {"imei": imei, "reason": "off_hand", "status": doc.get("status")}
+            else:
+                finding = {"imei": imei, "reason": "misplaced", "recorded_location": doc.get("current_location"), "status": doc.get("status")}
+            self.unexpected[imei] = finding
+            new_findings.append(finding)
+        return {"matched": matched, "duplicates": duplicates, "unexpected": new_findings}, fresh
+
+    def summary(self) -> dict:
+        misplaced = sum(1 for f in self.unexpected.values() if f["reason"] == "misplaced")
+        return {
+            "session_id": self.session["session_id"],
+            "location": self.location,
+            "organization": self.session.get("organization"),
+            "status": self.session["status"],
+            "expected": len(self.expected),
+            "counted": len(self.counted),
+            "matched": len(self.counted) - len(self.unexpected),
+            "missing": len(self.expected - self.counted),
+            "misplaced": misplaced,
+            "unexpected": len(self.unexpected) - misplaced,
+        }
+
+    def report(self) -> dict:
+        findings = list(self.unexpected.values())
+        return {
+            **self.summary(),
+            "missing_imeis": sorted(self.expected - self.counted),
+            "misplaced_units": [f for f in findings if f["reason"] == "misplaced"],
+            "unexpected_units": [f for f in findings if f["reason"] != "misplaced"],
+        }
+
+stock_take_sessions: Dict[str, StockTakeSession] = {}
+
+async def _load_expected_imeis(location: str, organization: Optional[str]) -> set:
+    query = {"current_location": location, "status": {"$nin": OFF_HAND_STATUSES}}
+    if organization:
+        query["organization"] = organization
+    cursor = db.imei_inventory.find(query, {"_id": 0, "imei": 1}).batch_size(10000)
+    return {doc["imei"] async for doc in cursor}
+
+async def _get_stock_take(session_id: str) -> StockTakeSession:
+    session = stock_take_sessions.get(session_id)
+    if session:
+        return session
+    doc = await db.stock_takes.find_one({"session_id": session_id}, {"_id": 0})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Stock-take session not found")
+    if doc["status"] != "Open":
+        raise HTTPException(status_code=400, detail="Stock-take session is closed")
+    # Rebuild from the snapshot stored at creation plus the scans recorded so far
+    session = StockTakeSession(doc, set(doc.get("expected_imeis", [])))
+    scanned = [s["imei"] async for s in db.stock_take_scans.find({"session_id": session_id}, {"_id": 0, "imei": 1}).batch_size(10000)]
+    await session.add(scanned)
+    stock_take_sessions[session_id] = session
+    return session
+
+@api_router.post("/stock-takes")
+async def start_stock_take(data: StockTakeCreate, current_user: User = Depends(get_current_user)):
+    from uuid import uuid4
+    expected = await _load_expected_imeis(data.location, data.organization)
+    doc = {
+        "session_id": str(uuid4()),
+        "location": data.location,
+        "organization": data.organization,
+        "status": "Open",
+        "expected_imeis": sorted(expected),
+        "created_by": current_user.user_id,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    await db.stock_takes.insert_one(doc)
+    session = StockTakeSession(doc, expected)
+    stock_take_sessions[doc["session_id"]] = session
+    await create_audit_log("CREATE", "StockTake", doc["session_id"], current_user, {"location": data.location, "expected": len(expected)})
+    return session.summary()
+
+@api_router.post("/stock-takes/{session_id}/scans")
+async def add_stock_take_scans(session_id: str, batch: StockTakeScanBatch, current_user: User = Depends(get_current_user)):
+    session = await _get_stock_take(session_id)
+    result, fresh = await session.add(batch.imeis)
+    if fresh:
+        await db.stock_take_scans.insert_many(
+            [{"session_id": session_id, "imei": imei, "scanned_by": current_user.user_id} for imei in fresh], ordered=False
+        )
+    return {**result, "totals": session.summary()}
+
+@api_router.get("/stock-takes/{session_id}")
+async def get_stock_take(session_id: str, current_user: User = Depends(get_current_user)):
+    doc = await db.stock_takes.find_one({"session_id": session_id}, {"_id": 0, "expected_imeis": 0})
+    if doc and doc["status"] == "Closed":
+        return doc
+    return (await _get_stock_take(session_id)).report()
+
+@api_router.post("/stock-takes/{session_id}/close")
+async def close_stock_take(session_id: str, current_user: User = Depends(get_current_user)):
+    session = await _get_stock_take(session_id)
+    session.session["status"] = "Closed"
+    report = session.report()
+    report["closed_by"] = current_user.user_id
+    report["closed_at"] = datetime.now(timezone.utc).isoformat()
+    await db.stock_takes.update_one({"session_id": session_id}, {"$set": report, "$unset": {"expected_imeis": ""}})
+    await db.stock_take_scans.delete_many({"session_id": session_id})
+    stock_take_sessions.pop(session_id, None)
+    await create_audit_log("CLOSE", "StockTake", session_id, current_user, {k: report[k] for k in ("expected", "counted", "missing", "misplaced", "unexpected")})
+    return report
+# ────────────────────────────────────────────────────────────────────────────────
 
 @api_router.get("/inventory", response_model=List[IMEIInventory])
 async def get_inventory(status: Optional[str] = None, organization: Optional[str] = None, current_user: User = Depends(get_current_user)):
@@ -1605,11 +3650,125 @@ async def get_imei_details(imei: str, current_user: User = Depends(get_current_u
         item['sold_date'] = datetime.fromisoformat(item['sold_date'])
     return IMEIInventory(**item)
 
+# ── Shipment fan-out to inventory ─────────────────────────────────────────────
+# Dispatching a shipment puts its units In Transit; delivering it moves them to the
+# destination. Each is one guarded update_many plus one batched imei_events insert.
+# Re-applying is a no-op: units already moved by this shipment are reported as such.
+SHIPMENT_INVENTORY_STATUS = {"In Transit": "dispatch", "Delivered": "deliver"}
+# Held for a sales order: a shipment never takes these, they are reported as unexpected
+SHIPMENT_HELD_STATUSES = ["Reserved"]
+
+async def apply_shipment_movement(shipment: dict, imeis: List[str], movement: str, current_user: User) -> dict:
+    shipment_id = shipment["shipment_id"]
+    now = datetime.now(timezone.utc).isoformat()
+    if movement == "dispatch":
+        target = "In Transit"
+        update_data = {"status": target, "shipped_date": now}
+        # Anything on hand and unreserved can leave, except units this shipment already delivered
+        eligible = {"status": {"$nin": OFF_HAND_STATUSES + SHIPMENT_HELD_STATUSES},
+                    "$nor": [{"status": "Delivered", "shipment_id": shipment_id}]}
+    else:
+        target = "Delivered"
+        update_data = {"status": target, "delivered_date": now, "current_location": shipment["to_location"]}
+        # In transit on this shipment, or on hand (shipments created before dispatch fan-out)
+        eligible = {"$or": [{"status": "In Transit", "shipment_id": shipment_id},
+                            {"status": {"$nin": OFF_HAND_STATUSES + SHIPMENT_HELD_STATUSES}}]}
+    update_data.update({"shipment_id": shipment_id, "updated_at": now})
+
+    imeis = list(dict.fromkeys(imeis))
+    current = {doc["imei"]: doc for doc in await db.imei_inventory.find(
+        {"imei": {"$in": imeis}}, {"_id": 0, "imei": 1, "status": 1, "current_location": 1, "organization": 1, "shipment_id": 1}
+    ).to_list(None)}
+    missing = [imei for imei in imeis if imei not in current]
+    already = {imei for imei, doc in current.items() if doc.get("status") == target and doc.get("shipment_id") == shipment_id}
+    candidates = [imei for imei in current if imei not in already]
+
+    moved = []
+    if candidates:
+        await db.imei_inventory.update_many({"imei": {"$in": candidates}, **eligible}, {"$set": update_data})
+        # Read back which candidates this call moved (others changed state concurrently or were ineligible)
+        moved = [doc["imei"] for doc in await db.imei_inventory.find(
+            {"imei": {"$in": candidates}, "shipment_id": shipment_id, "updated_at": now, "status": target}, {"_id": 0, "imei": 1}
+        ).to_list(None)]
+    moved_set = set(moved)
+    unexpected = [{"imei": imei, "status": current[imei].get("status"), "location": current[imei].get("current_location")}
+                  for imei in candidates if imei not in moved_set]
+
+    if moved:
+        inventory_rollups.invalidate()
+        catalog_fields = {k: update_data[k] for k in ("status", "current_location") if k in update_data}
+        await db.imei_catalog.update_many({"imei": {"$in": moved}}, {"$set": catalog_fields})
+        await record_imei_events([imei_event(imei, movement, current[imei], update_data, current_user, "shipment", shipment_id)
+                                  for imei in moved])
+    report = {"movement": movement, "status": target, "moved": len(moved), "already_applied": len(already),
+              "missing": missing, "unexpected": unexpected}
+    await create_audit_log("SHIPMENT_" + movement.upper(), "Shipment", shipment_id, current_user,
+                           {"moved": len(moved), "already_applied": len(already), "missing": len(missing), "unexpected": len(unexpected)})
+    return report
+
+# ── Shipment items ────────────────────────────────────────────────────────────
+# A shipment's IMEIs live in shipment_items (one document per unit) rather than an
+# embedded imei_list, so shipment listings stay small and "which shipment carried
+# IMEI X" is an index lookup.
+SHIPMENT_ITEMS_PAGE_MAX = 1000
+
+async def insert_shipment_items(shipment: dict, imeis: List[str]):
+    docs = [{"shipment_id": shipment["shipment_id"], "po_number": shipment.get("po_number"), "position": n, "imei": imei}
+            for n, imei in enumerate(dict.fromkeys(imeis))]
+    if not docs:
+        return
+    try:
+        await db.shipment_items.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # Re-running a migration: items already written are left as they are
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+async def shipment_imeis(shipment: dict) -> List[str]:
+    if shipment.get("imei_list"):  # not yet migrated
+        return shipment["imei_list"]
+    cursor = db.shipment_items.find({"shipment_id": shipment["shipment_id"]}, {"_id": 0, "imei": 1}).sort("position", 1)
+    return [doc["imei"] async for doc in cursor.batch_size(5000)]
+
+async def backfill_procured_inventory_fields():
+    """Copy price, PO and brand/model fields onto procured units created without them (first deploy)."""
+    query = {"procurement_id": {"$ne": None}, "purchase_price": {"$exists": False}}
+    while True:
+        units = await db.imei_inventory.find(query, {"_id": 0, "imei": 1, "procurement_id": 1}).limit(IMEI_CATALOG_CHUNK).to_list(None)
+        if not units:
+            break
+        procurement = {d["imei"]: d for d in await db.procurement.find(
+            {"procurement_id": {"$in": [u["procurement_id"] for u in units]}}, {"_id": 0}
+        ).to_list(None)}
+        po_items = await load_po_item_candidates(procurement, list(procurement))
+        ops = []
+        for unit in units:
+            proc = procurement.get(unit["imei"])
+            if proc is None:  # procurement deleted; record the price as unknown so the unit is not revisited
+                ops.append(UpdateOne({"imei": unit["imei"]}, {"$set": {"purchase_price": None}}))
+                continue
+            fields = _procured_inventory_fields(proc, _match_po_item(po_items.get(proc.get("po_number"), []), unit["imei"], proc.get("vendor_name")))
+            # Only fill what is missing; scanned values win
+            ops.append(UpdateOne({"imei": unit["imei"]}, [{"$set": {k: {"$ifNull": [f"${k}", {"$literal": v}]} for k, v in fields.items()}}]))
+        await db.imei_inventory.bulk_write(ops, ordered=False)
+    inventory_rollups.invalidate()
+
+async def migrate_shipment_items():
+    """Move embedded imei_list arrays into shipment_items (first deploy after the split)."""
+    async for shipment in db.logistics_shipments.find({"imei_list": {"$exists": True}}, {"_id": 0}):
+        await insert_shipment_items(shipment, shipment.get("imei_list") or [])
+        await db.logistics_shipments.update_one(
+            {"shipment_id": shipment["shipment_id"]},
+            {"$set": {"item_count": len(set(shipment.get("imei_list") or []))}, "$unset": {"imei_list": ""}}
+        )
+# ────────────────────────────────────────────────────────────────────────────────
+
 # Logistics Endpoints
 @api_router.post("/logistics/shipments", response_model=LogisticsShipment)
 async def create_shipment(shipment_data: ShipmentCreate, current_user: User = Depends(get_current_user)):
     from uuid import uuid4
     expected_delivery = shipment_data.expected_delivery or (shipment_data.pickup_date + timedelta(days=3))
+    imei_list = list(dict.fromkeys(shipment_data.imei_list))
     
     shipment_doc = {
         "shipment_id": str(uuid4()),
@@ -1623,8 +3782,8 @@ async def create_shipment(shipment_data: ShipmentCreate, current_user: User = De
         "expected_delivery": expected_delivery.isoformat(),
         "actual_delivery": None,
         "status": "In Transit",
-        "imei_list": shipment_data.imei_list,
-        "pickup_quantity": shipment_data.pickup_quantity or len(shipment_data.imei_list),
+        "item_count": len(imei_list),
+        "pickup_quantity": shipment_data.pickup_quantity or len(imei_list),
         "brand": shipment_data.brand,
         "model": shipment_data.model,
         "vendor": shipment_data.vendor,
@@ -1633,32 +3792,48 @@ async def create_shipment(shipment_data: ShipmentCreate, current_user: User = De
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
+    await insert_shipment_items(shipment_doc, imei_list)
     await db.logistics_shipments.insert_one(shipment_doc)
     await create_audit_log("CREATE", "Shipment", shipment_doc["shipment_id"], current_user, {"pickup_quantity": shipment_doc["pickup_quantity"], "vendor": shipment_data.vendor})
+    if imei_list:
+        await apply_shipment_movement(shipment_doc, imei_list, "dispatch", current_user)
     
     return LogisticsShipment(**{k: v for k, v in shipment_doc.items() if k != "_id"})
 
 @api_router.patch("/logistics/shipments/{shipment_id}/status")
 async def update_shipment_status(shipment_id: str, status_update: ShipmentStatusUpdate, current_user: User = Depends(get_current_user)):
-    result = await db.logistics_shipments.update_one(
-        {"shipment_id": shipment_id},
+    query = {"shipment_id": shipment_id}
+    if status_update.status == "In Transit":
+        # A delivered shipment does not go back on the road
+        query["status"] = {"$ne": "Delivered"}
+    shipment = await db.logistics_shipments.find_one_and_update(
+        query,
         {
             "$set": {
                 "status": status_update.status,
                 "updated_at": datetime.now(timezone.utc).isoformat(),
                 "actual_delivery": datetime.now(timezone.utc).isoformat() if status_update.status == "Delivered" else None
             }
-        }
+        },
+        projection={"_id": 0}
     )
-    if result.matched_count == 0:
+    if shipment is None:
+        if "status" in query and await db.logistics_shipments.count_documents({"shipment_id": shipment_id}, limit=1):
+            raise HTTPException(status_code=409, detail="Shipment is already Delivered")
         raise HTTPException(status_code=404, detail="Shipment not found")
     
     await create_audit_log("UPDATE", "Shipment", shipment_id, current_user, {"new_status": status_update.status})
-    return {"message": "Status updated successfully"}
+    response = {"message": "Status updated successfully"}
+    movement = SHIPMENT_INVENTORY_STATUS.get(status_update.status)
+    if movement:
+        imeis = await shipment_imeis(shipment)
+        if imeis:
+            response["inventory"] = await apply_shipment_movement(shipment, imeis, movement, current_user)
+    return response
 
 @api_router.get("/logistics/shipments", response_model=List[LogisticsShipment])
-async def get_shipments(current_user: User = Depends(get_current_user)):
-    shipments = await db.logistics_shipments.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+async def get_shipments(include_archive: bool = False, current_user: User = Depends(get_current_user)):
+    shipments = await find_with_archive("logistics_shipments", {}, {"_id": 0, "imei_list": 0}, [("created_at", -1)], 1000, include_archive)
     for shipment in shipments:
         if isinstance(shipment.get('pickup_date'), str):
             shipment['pickup_date'] = datetime.fromisoformat(shipment['pickup_date'])
@@ -1672,7 +3847,7 @@ async def get_shipments(current_user: User = Depends(get_current_user)):
             shipment['updated_at'] = datetime.fromisoformat(shipment['updated_at'])
         # Ensure backward compatibility
         if 'pickup_quantity' not in shipment:
-            shipment['pickup_quantity'] = len(shipment.get('imei_list', []))
+            shipment['pickup_quantity'] = shipment.get('item_count', 0)
         if 'brand' not in shipment:
             shipment['brand'] = None
         if 'model' not in shipment:
@@ -1681,6 +3856,34 @@ async def get_shipments(current_user: User = Depends(get_current_user)):
             shipment['vendor'] = None
     return [LogisticsShipment(**shipment) for shipment in shipments]
 
+@api_router.get("/logistics/shipments/by-imei/{imei}")
+async def get_shipments_for_imei(imei: str, current_user: User = Depends(get_current_user)):
+    """Shipments that carried an IMEI, newest first"""
+    shipment_ids = await db.shipment_items.distinct("shipment_id", {"imei": imei})
+    shipments = await db.logistics_shipments.find(
+        {"shipment_id": {"$in": shipment_ids}}, {"_id": 0, "imei_list": 0}
+    ).sort("created_at", -1).to_list(None)
+    return {"imei": imei, "shipments": shipments}
+
+@api_router.get("/logistics/shipments/{shipment_id}/items")
+async def get_shipment_items(shipment_id: str, after: int = -1, limit: int = 500, current_user: User = Depends(get_current_user)):
+    """IMEIs on a shipment in pickup order; pass `next_after` back as `after` for the next page"""
+    shipment = await db.logistics_shipments.find_one({"shipment_id": shipment_id}, {"_id": 0, "item_count": 1, "imei_list": 1})
+    if not shipment:
+        raise HTTPException(status_code=404, detail="Shipment not found")
+    limit = max(1, min(limit, SHIPMENT_ITEMS_PAGE_MAX))
+    items = await db.shipment_items.find(
+        {"shipment_id": shipment_id, "position": {"$gt": after}}, {"_id": 0, "position": 1, "imei": 1}
+    ).sort("position", 1).limit(limit).to_list(limit)
+    if not items and shipment.get("imei_list"):  # not yet migrated
+        items = [{"position": n, "imei": imei} for n, imei in enumerate(shipment["imei_list"]) if n > after][:limit]
+    return {
+        "shipment_id": shipment_id,
+        "item_count": shipment.get("item_count", len(shipment.get("imei_list") or [])),
+        "items": items,
+        "next_after": items[-1]["position"] if len(items) == limit else None,
+    }
+
 # Invoice Endpoints
 @api_router.post("/invoices", response_model=Invoice)
 async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depends(get_current_user)):
@@ -1716,8 +3919,8 @@ async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depen
     return Invoice(**{k: v for k, v in invoice_doc.items() if k != "_id"})
 
 @api_router.get("/invoices", response_model=List[Invoice])
-async def get_invoices(current_user: User = Depends(get_current_user)):
-    invoices = await db.invoices.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+async def get_invoices(include_archive: bool = False, current_user: User = Depends(get_current_user)):
+    invoices = await find_with_archive("invoices", {}, {"_id": 0}, [("created_at", -1)], 1000, include_archive)
     for invoice in invoices:
         if isinstance(invoice.get('invoice_date'), str):
             invoice['invoice_date'] = datetime.fromisoformat(invoice['invoice_date'])
@@ -1735,38 +3938,98 @@ async def get_invoices(current_user: User = Depends(get_current_user)):
     return [Invoice(**invoice) for invoice in invoices]
 
 # Sales Order Endpoints
+async def reserve_imeis(sales_order_id: str, imeis: List[str]) -> tuple:
+    """Flip Available → Reserved for `imeis` in one conditional update_many.
+
+    Each document update is atomic, so overlapping orders can never both reserve a unit.
+    Units are tagged with `reserved_for` to tell which ones this order won.
+    Returns (reserved, unavailable) IMEI lists in input order.
+    """
+    if not imeis:
+        return [], []
+    await db.imei_inventory.update_many(
+        {"imei": {"$in": imeis}, "status": "Available"},
+        {"$set": {"status": "Reserved", "reserved_for": sales_order_id, "updated_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    inventory_rollups.invalidate()
+    won = await db.imei_inventory.find(
+        {"imei": {"$in": imeis}, "reserved_for": sales_order_id}, {"_id": 0, "imei": 1, "current_location": 1}
+    ).to_list(None)
+    won_docs = {doc["imei"]: doc for doc in won}
+    won = set(won_docs)
+    if won:
+        await db.imei_catalog.update_many({"imei": {"$in": list(won)}}, {"$set": {"status": "Reserved"}})
+        await record_imei_events([
+            imei_event(imei, "reserve", {"status": "Available", "current_location": doc.get("current_location")},
+                       {"status": "Reserved"}, None, "sales_order", sales_order_id)
+            for imei, doc in won_docs.items()
+        ])
+    return [i for i in imeis if i in won], [i for i in imeis if i not in won]
+
+async def release_imeis(sales_order_id: str, imeis: List[str]) -> int:
+    """Return this order's reservations to Available. Untagged (legacy) reservations are released too."""
+    if not imeis:
+        return 0
+    held = {
+        "imei": {"$in": imeis},
+        "status": "Reserved",
+        "$or": [{"reserved_for": sales_order_id}, {"reserved_for": {"$exists": False}}]
+    }
+    held_docs = await db.imei_inventory.find(held, {"_id": 0, "imei": 1, "current_location": 1}).to_list(None)
+    update_data = {"status": "Available", "updated_at": datetime.now(timezone.utc).isoformat()}
+    result = await db.imei_inventory.update_many(held, {"$set": update_data, "$unset": {"reserved_for": ""}})
+    if result.modified_count:
+        inventory_rollups.invalidate()
+        await refresh_imei_catalog(imeis)
+        await record_imei_events([
+            imei_event(doc["imei"], "release", {**doc, "status": "Reserved"}, update_data, None, "sales_order", sales_order_id)
+            for doc in held_docs
+        ])
+    return result.modified_count
+
 @api_router.post("/sales-orders", response_model=SalesOrder)
 async def create_sales_order(so_data: SalesOrderCreate, current_user: User = Depends(get_current_user)):
     from uuid import uuid4
     if current_user.organization != "Magnova":
         raise HTTPException(status_code=403, detail="Only Magnova can create sales orders")
     
-    so_count = await db.sales_orders.count_documents({}) + 1
-    so_number = f"SO-MAG-{so_count:05d}"
-    
-    so_doc = {
-        "sales_order_id": str(uuid4()),
-        "so_number": so_number,
-        "customer_name": so_data.customer_name,
-        "customer_type": so_data.customer_type,
-        "total_quantity": so_data.total_quantity,
-        "total_amount": so_data.total_amount,
-        "status": "Created",
-        "imei_list": so_data.imei_list,
-        "created_by": current_user.user_id,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
-    }
-    
-    await db.sales_orders.insert_one(so_doc)
-    
-    for imei in so_data.imei_list:
-        await db.imei_inventory.update_one(
-            {"imei": imei},
-            {"$set": {"status": "Reserved", "updated_at": datetime.now(timezone.utc).isoformat()}}
+    sales_order_id = str(uuid4())
+    imei_list = list(dict.fromkeys(so_data.imei_list))  # de-duplicate, keep order
+
+    # Reserve stock before the order exists; all-or-nothing
+    reserved, unavailable = await reserve_imeis(sales_order_id, imei_list)
+    if unavailable:
+        await release_imeis(sales_order_id, reserved)
+        raise HTTPException(
+            status_code=409,
+            detail={"message": f"{len(unavailable)} IMEI(s) are not Available", "unavailable_imeis": unavailable}
         )
     
-    await create_audit_log("CREATE", "SalesOrder", so_number, current_user, {"customer": so_data.customer_name})
+    # Until the order is stored nothing points at these reservations, so undo them on failure
+    try:
+        so_count = await db.sales_orders.count_documents({}) + 1
+        so_number = f"SO-MAG-{so_count:05d}"
+
+        so_doc = {
+            "sales_order_id": sales_order_id,
+            "so_number": so_number,
+            "customer_name": so_data.customer_name,
+            "customer_type": so_data.customer_type,
+            "total_quantity": so_data.total_quantity,
+            "total_amount": so_data.total_amount,
+            "status": "Created",
+            "imei_list": imei_list,
+            "created_by": current_user.user_id,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }
+
+        await db.sales_orders.insert_one(so_doc)
+    except Exception:
+        await release_imeis(sales_order_id, reserved)
+        raise
+    
+    await create_audit_log("CREATE", "SalesOrder", so_number, current_user, {"customer": so_data.customer_name, "reserved": len(reserved)})
     
     return SalesOrder(**{k: v for k, v in so_doc.items() if k != "_id"})
 
@@ -2021,85 +4284,589 @@ async def export_master_report(current_user: User = Depends(get_current_user)):
         headers={"Content-Disposition": "attachment; filename=master_report.xlsx"}
     )
 
+# ── Audit log query & retention ───────────────────────────────────────────────
+AUDIT_ARCHIVE_PREFIX = "audit_logs_archive_"
+# Entries older than this move from audit_logs into monthly audit_logs_archive_YYYYMM collections
+AUDIT_HOT_RETENTION_DAYS = int(os.environ.get("AUDIT_HOT_RETENTION_DAYS", 90))
+AUDIT_ARCHIVE_INTERVAL = int(os.environ.get("AUDIT_ARCHIVE_INTERVAL", 3600))
+AUDIT_ARCHIVE_BATCH = int(os.environ.get("AUDIT_ARCHIVE_BATCH", 1000))
+AUDIT_LOG_PAGE_MAX = 500
+
+def audit_log_indexes() -> List[IndexModel]:
+    """Indexes backing GET /audit-logs; applied to the hot collection and every archive month."""
+    return [
+        IndexModel("log_id", unique=True),
+        IndexModel([("timestamp", -1), ("log_id", -1)]),
+        *[IndexModel([(field, 1), ("timestamp", -1), ("log_id", -1)]) for field in ["entity_type", "entity_id", "user_id", "action"]],
+    ]
+
+async def create_audit_log_indexes(collection):
+    await collection.create_indexes(audit_log_indexes())
+
+def _encode_audit_cursor(log: dict) -> str:
+    import base64
+    return base64.urlsafe_b64encode(json.dumps([log["timestamp"], log["log_id"]]).encode()).decode()
+
+def _decode_audit_cursor(cursor: str) -> tuple:
+    import base64
+    try:
+        timestamp, log_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return timestamp, log_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _audit_month_key(timestamp: str) -> str:
+    return timestamp[:7].replace("-", "")
+
+class AuditArchiveJob(PeriodicJob):
+    """Moves audit entries past the hot retention window into monthly archive collections.
+
+    Batches are copied with an unordered insert_many (duplicate log_ids from an interrupted
+    run are ignored) and only then deleted from the hot collection, so a crash mid-run
+    never loses entries.
+    """
+    name = "audit-archive"
+
+    def __init__(self, database, interval: float = AUDIT_ARCHIVE_INTERVAL, retention_days: int = AUDIT_HOT_RETENTION_DAYS,
+                 batch_size: int = AUDIT_ARCHIVE_BATCH, clock: Callable[[], datetime] = utc_now):
+        super().__init__(interval, clock)
+        self.database = database
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self._indexed_archives = set()
+
+    def forget_archives(self):
+        """Archive collections were dropped; index them again when next written"""
+        self._indexed_archives.clear()
+
+    async def run_once(self) -> int:
+        cutoff = (self.clock() - timedelta(days=self.retention_days)).isoformat()
+        moved = 0
+        while True:
+            batch = await self.database.audit_logs.find({"timestamp": {"$lt": cutoff}}) \
+                .sort([("timestamp", 1), ("log_id", 1)]).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                break
+            by_month: Dict[str, List[dict]] = {}
+            for log in batch:
+                by_month.setdefault(_audit_month_key(log["timestamp"]), []).append(log)
+            for month, logs in by_month.items():
+                archive = self.database[f"{AUDIT_ARCHIVE_PREFIX}{month}"]
+                if month not in self._indexed_archives:
+                    await create_audit_log_indexes(archive)
+                    self._indexed_archives.add(month)
+                try:
+                    await archive.insert_many(logs, ordered=False)
+                except BulkWriteError as e:
+                    if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                        raise
+            await self.database.audit_logs.delete_many({"_id": {"$in": [log["_id"] for log in batch]}})
+            moved += len(batch)
+        if moved:
+            logging.info(f"Audit archive: moved {moved} entries older than {cutoff}")
+        return moved
+
+audit_archive_job = AuditArchiveJob(db)
+
+# ── Closed PO archival ────────────────────────────────────────────────────────
+# Fully closed POs untouched for PO_ARCHIVE_AFTER_DAYS move, with their procurement,
+# payments, shipments and invoices, into `<collection>_archive`. List endpoints read
+# the archive only with include_archive=true. Inventory and catalog entries stay where
+# they are, so IMEI lookups are unaffected.
+PO_ARCHIVE_AFTER_DAYS = int(os.environ.get("PO_ARCHIVE_AFTER_DAYS", 180))
+PO_ARCHIVE_INTERVAL = int(os.environ.get("PO_ARCHIVE_INTERVAL", 6 * 3600))
+PO_ARCHIVE_BATCH = int(os.environ.get("PO_ARCHIVE_BATCH", 1000))
+PO_ARCHIVE_MAX_POS = int(os.environ.get("PO_ARCHIVE_MAX_POS", 100))   # POs per run
+PO_ARCHIVE_CHILDREN = ["procurement", "payments", "logistics_shipments", "shipment_items", "invoices", "po_items"]
+CLOSED_UNIT_STATUSES = ["Sold", "Dispatched"]
+
+def archive_name(collection: str) -> str:
+    return f"{collection}_archive"
+
+class POArchiveJob(PeriodicJob):
+    """Moves closed POs and their documents to the archive collections.
+
+    A PO is closed when it is approved, every procured unit is sold or dispatched, every
+    gap is zero or resolved, and it is fully paid (see po_payments_settled). The PO is
+    flagged `archiving` before anything moves and is itself moved last, so an interrupted
+    run finishes on the next pass. Copies are unordered insert_many calls that skip
+    duplicates, and hot documents are deleted only after they are copied.
+    """
+    name = "po-archive"
+
+    def __init__(self, database, interval: float = PO_ARCHIVE_INTERVAL, after_days: int = PO_ARCHIVE_AFTER_DAYS,
+                 batch_size: int = PO_ARCHIVE_BATCH, max_pos: int = PO_ARCHIVE_MAX_POS,
+                 clock: Callable[[], datetime] = utc_now):
+        super().__init__(interval, clock)
+        self.database = database
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.max_pos = max_pos
+
+    async def is_closed(self, po_number: str, cutoff: str) -> bool:
+        database = self.database
+        if await database.procurement.count_documents({"po_number": po_number}, limit=1) == 0:
+            return False
+        # PO updated_at only moves on approval, so recent child activity keeps it hot too
+        for collection in ("procurement", "payments", "logistics_shipments", "invoices"):
+            if await database[collection].count_documents({"po_number": po_number, "created_at": {"$gte": cutoff}}, limit=1):
+                return False
+        if await database.procurement.count_documents(
+            {"po_number": po_number, "gap_qty": {"$gt": 0}, "gap_resolved": {"$ne": True}}, limit=1
+        ):
+            return False
+        po = await database.purchase_orders.find_one({"po_number": po_number}, {"_id": 0, "po_number": 1, "total_value": 1})
+        if not po or not po_payments_settled(await po_payment_totals(database, po)):
+            return False
+        imeis = []
+        async for proc in database.procurement.find({"po_number": po_number}, {"_id": 0, "imei": 1}).batch_size(self.batch_size):
+            imeis.append(proc.get("imei"))
+            if len(imeis) == self.batch_size:
+                if await database.imei_inventory.count_documents(
+                    {"imei": {"$in": imeis}, "status": {"$nin": CLOSED_UNIT_STATUSES}}, limit=1
+                ):
+                    return False
+                imeis = []
+        return not imeis or not await database.imei_inventory.count_documents(
+            {"imei": {"$in": imeis}, "status": {"$nin": CLOSED_UNIT_STATUSES}}, limit=1
+        )
+
+    async def _move(self, collection: str, query: dict) -> int:
+        hot, cold = self.database[collection], self.database[archive_name(collection)]
+        moved = 0
+        while True:
+            batch = await hot.find(query).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                return moved
+            try:
+                await cold.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+            await hot.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+            moved += len(batch)
+
+    async def archive_po(self, po_number: str) -> Dict[str, int]:
+        await self.database.purchase_orders.update_one({"po_number": po_number}, {"$set": {"archiving": True}})
+        counts = {collection: await self._move(collection, {"po_number": po_number}) for collection in PO_ARCHIVE_CHILDREN}
+        counts["purchase_orders"] = await self._move("purchase_orders", {"po_number": po_number})
+        return counts
+
+    async def run_once(self) -> int:
+        cutoff = (self.clock() - timedelta(days=self.after_days)).isoformat()
+        # Interrupted runs first, then candidates by age
+        pending = await self.database.purchase_orders.find({"archiving": True}, {"_id": 0, "po_number": 1}).to_list(None)
+        candidates = await self.database.purchase_orders.find(
+            {"approval_status": "Approved", "status": {"$ne": "Deleting"}, "updated_at": {"$lt": cutoff}, "archiving": {"$ne": True}},
+            {"_id": 0, "po_number": 1}
+        ).sort("updated_at", 1).limit(self.max_pos).to_list(self.max_pos)
+        archived = 0
+        for po in pending:
+            await self.archive_po(po["po_number"])
+            archived += 1
+        for po in candidates:
+            if await self.is_closed(po["po_number"], cutoff):
+                await self.archive_po(po["po_number"])
+                archived += 1
+        if archived:
+            logging.info(f"PO archive: moved {archived} closed POs last updated before {cutoff}")
+        return archived
+
+po_archive_job = POArchiveJob(db)
+
+async def find_with_archive(collection: str, query: dict, projection: dict, sort: List[Tuple[str, int]], limit: Optional[int],
+                            include_archive: bool) -> List[dict]:
+    """Query a hot collection and, when asked, its archive; results merged in `sort` order"""
+    docs = await db[collection].find(query, projection).sort(sort).to_list(limit)
+    if not include_archive:
+        return docs
+    docs += await db[archive_name(collection)].find(query, projection).sort(sort).to_list(limit)
+    for field, direction in reversed(sort):
+        docs.sort(key=lambda d: (d.get(field) is not None, d[field] if d.get(field) is not None else ""), reverse=direction < 0)
+    return docs[:limit]
+# ────────────────────────────────────────────────────────────────────────────────
+
+# ── Global search ────────────────────────────────────────────────────────────
+import time
+
+# Every source is one indexed query (exact value or anchored prefix regex, both of
+# which use the field index) and all sources run concurrently. A source that misses
+# SEARCH_SOURCE_TIMEOUT_MS is reported in `timed_out` instead of holding up the rest.
+SEARCH_MIN_LENGTH = 3
+SEARCH_SOURCE_LIMIT = 10
+SEARCH_SOURCE_TIMEOUT_MS = int(os.environ.get("SEARCH_SOURCE_TIMEOUT_MS", 800))
+SEARCH_BUDGET_MS = int(os.environ.get("SEARCH_BUDGET_MS", 1500))
+
+# entity type -> (collection, searched fields, returned fields)
+SEARCH_SOURCES = {
+    "purchase_order": ("purchase_orders", ["po_number"], ["po_number", "status", "approval_status", "purchase_office", "total_quantity", "created_at"]),
+    "imei": ("imei_inventory", ["imei", "imei2"], ["imei", "imei2", "brand", "model", "status", "current_location", "organization"]),
+    "serial_number": ("procurement", ["serial_number"], ["serial_number", "imei", "po_number", "vendor_name", "device_model"]),
+    "payment": ("payments", ["utr_number"], ["payment_id", "utr_number", "po_number", "payee_name", "amount", "status"]),
+    "invoice": ("invoices", ["invoice_number"], ["invoice_number", "po_number", "amount", "status", "created_at"]),
+    "sales_order": ("sales_orders", ["so_number"], ["so_number", "customer_name", "status", "created_at"]),
+}
+
+def _search_filters(fields: List[str], q: str) -> Tuple[dict, dict]:
+    prefix = {"$regex": f"^{re.escape(q)}"}
+    return {"$or": [{field: q} for field in fields]}, {"$or": [{field: prefix} for field in fields]}
+
+def _search_rank(doc: dict, fields: List[str], q: str) -> Tuple[Tuple[int, str], bool]:
+    """Sort key (exact matches first, then by the matched value) and whether the match was exact"""
+    values = [str(doc.get(field)) for field in fields if doc.get(field) is not None]
+    exact = q in values
+    matched = next((v for v in values if v.startswith(q)), values[0] if values else "")
+    return (0 if exact else 1, matched), exact
+
+async def _search_source(entity: str, q: str, limit: int) -> List[dict]:
+    collection, fields, returned = SEARCH_SOURCES[entity]
+    projection = {"_id": 0, **{field: 1 for field in returned}}
+    # The exact lookup runs alongside the prefix scan so an exact hit is never crowded
+    # out of the limit by longer values sharing its prefix
+    exact_docs, prefix_docs = await asyncio.gather(*[
+        db[collection].find(query, projection).max_time_ms(SEARCH_SOURCE_TIMEOUT_MS).limit(limit).to_list(limit)
+        for query in _search_filters(fields, q)
+    ])
+    docs = {json.dumps(doc, sort_keys=True, default=str): doc for doc in exact_docs + prefix_docs}.values()
+    ranked = []
+    for doc in docs:
+        key, exact = _search_rank(doc, fields, q)
+        ranked.append((key, {**doc, "exact": exact}))
+    return [doc for _, doc in sorted(ranked, key=lambda pair: pair[0])][:limit]
+
+async def _search_vendors(q: str, limit: int) -> List[dict]:
+    """Vendors have no collection of their own; distinct procurement vendor_names"""
+    pipeline = [
+        {"$match": {"vendor_name": {"$regex": f"^{re.escape(q)}"}}},
+        {"$group": {"_id": "$vendor_name", "units": {"$sum": 1}, "po_numbers": {"$addToSet": "$po_number"}}},
+        {"$sort": {"_id": 1}},
+        {"$limit": limit},
+    ]
+    rows = await db.procurement.aggregate(pipeline, maxTimeMS=SEARCH_SOURCE_TIMEOUT_MS).to_list(limit)
+    vendors = [{"vendor_name": row["_id"], "units": row["units"], "po_count": len(row["po_numbers"]), "exact": row["_id"] == q}
+               for row in rows]
+    return sorted(vendors, key=lambda v: not v["exact"])
+
+@api_router.get("/search")
+async def global_search(q: str, limit: int = SEARCH_SOURCE_LIMIT, current_user: User = Depends(get_current_user)):
+    q = q.strip()
+    if len(q) < SEARCH_MIN_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Search needs at least {SEARCH_MIN_LENGTH} characters")
+    limit = max(1, min(limit, 50))
+    started = time.perf_counter()
+
+    searches = {entity: _search_source(entity, q, limit) for entity in SEARCH_SOURCES}
+    searches["vendor"] = _search_vendors(q, limit)
+    tasks = {
+        entity: asyncio.ensure_future(asyncio.wait_for(search, SEARCH_SOURCE_TIMEOUT_MS / 1000))
+        for entity, search in searches.items()
+    }
+    await asyncio.wait(tasks.values(), timeout=SEARCH_BUDGET_MS / 1000)
+
+    results, timed_out, failed = {}, [], []
+    for entity, task in tasks.items():
+        if not task.done():
+            task.cancel()
+            timed_out.append(entity)
+        elif task.cancelled() or isinstance(task.exception(), asyncio.TimeoutError):
+            timed_out.append(entity)
+        elif task.exception() is not None:
+            # maxTimeMS expiry surfaces as a server error; either way the source is skipped
+            logging.warning(f"Search source {entity} failed: {task.exception()}")
+            failed.append(entity)
+        elif task.result():
+            results[entity] = task.result()
+
+    # Groups with an exact hit come first, then by group size
+    groups = sorted(results.items(), key=lambda item: (not any(doc["exact"] for doc in item[1]), -len(item[1])))
+    return {
+        "query": q,
+        "groups": [{"type": entity, "count": len(docs), "results": docs} for entity, docs in groups],
+        "total": sum(len(docs) for docs in results.values()),
+        "timed_out": timed_out,
+        "failed": failed,
+        "took_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+# ────────────────────────────────────────────────────────────────────────────────
+
 @api_router.get("/audit-logs")
-async def get_audit_logs(entity_type: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def get_audit_logs(
+    entity_type: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    action: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    include_archive: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Newest-first audit entries. Pass `next_cursor` back as `cursor` for the next page.
+
+    Archived months are only read when `include_archive` is set.
+    """
+    limit = max(1, min(limit, AUDIT_LOG_PAGE_MAX))
     query = {}
-    if entity_type:
-        query["entity_type"] = entity_type
-    
-    logs = await db.audit_logs.find(query, {"_id": 0}).sort("timestamp", -1).limit(500).to_list(500)
-    return logs
+    for field, value in [("entity_type", entity_type), ("entity_id", entity_id), ("user_id", user_id), ("action", action)]:
+        if value:
+            query[field] = value
+
+    time_range = {}
+    if start:
+        time_range["$gte"] = (start if start.tzinfo else start.replace(tzinfo=timezone.utc)).astimezone(timezone.utc).isoformat()
+    if end:
+        time_range["$lt"] = (end if end.tzinfo else end.replace(tzinfo=timezone.utc)).astimezone(timezone.utc).isoformat()
+    if time_range:
+        query["timestamp"] = time_range
+    if cursor:
+        cursor_ts, cursor_id = _decode_audit_cursor(cursor)
+        query = {"$and": [query, {"$or": [
+            {"timestamp": {"$lt": cursor_ts}},
+            {"timestamp": cursor_ts, "log_id": {"$lt": cursor_id}},
+        ]}]}
+
+    sources = [db.audit_logs]
+    if include_archive:
+        archive_names = await db.list_collection_names(filter={"name": {"$regex": f"^{AUDIT_ARCHIVE_PREFIX}"}})
+        low = _audit_month_key(time_range["$gte"]) if "$gte" in time_range else "000000"
+        high = _audit_month_key(time_range["$lt"]) if "$lt" in time_range else "999999"
+        months = sorted((name[len(AUDIT_ARCHIVE_PREFIX):] for name in archive_names), reverse=True)
+        sources += [db[f"{AUDIT_ARCHIVE_PREFIX}{m}"] for m in months if low <= m <= high]
+
+    # Archived months only hold entries older than the hot collection, so reading the
+    # sources in order (hot, then newest month first) keeps the page newest-first.
+    logs: List[dict] = []
+    for source in sources:
+        remaining = limit + 1 - len(logs)
+        if remaining <= 0:
+            break
+        logs += await source.find(query, {"_id": 0}).sort([("timestamp", -1), ("log_id", -1)]).limit(remaining).to_list(remaining)
+
+    next_cursor = _encode_audit_cursor(logs[limit - 1]) if len(logs) > limit else None
+    return {"logs": logs[:limit], "next_cursor": next_cursor}
+# ────────────────────────────────────────────────────────────────────────────────
+
+@api_router.get("/admin/audit-sink")
+async def get_audit_sink_stats(current_user: User = Depends(get_current_user)):
+    """Buffer depth and backpressure counters of the buffered audit-log writer"""
+    if current_user.role != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return audit_sink.stats()
 
 # DELETE ENDPOINTS - Admin Only with CASCADE
+# ── PO cascade delete (background) ────────────────────────────────────────────
+# Deleting a PO queues a job in po_delete_jobs and returns at once. The worker removes
+# related documents in bounded batches, pausing between them, and keeps its progress
+# on the job document. Every step re-reads what is left by po_number, so a job
+# interrupted by a crash or restart is picked up again once its lease expires. A job
+# whose batches keep raising is marked Failed after PO_DELETE_MAX_ATTEMPTS tries and
+# left alone; deleting the PO again queues a fresh job.
+PO_DELETE_BATCH = int(os.environ.get("PO_DELETE_BATCH", 500))
+PO_DELETE_PAUSE = float(os.environ.get("PO_DELETE_PAUSE", 0.05))      # seconds between batches
+PO_DELETE_LEASE_SECONDS = int(os.environ.get("PO_DELETE_LEASE_SECONDS", 60))
+PO_DELETE_INTERVAL = float(os.environ.get("PO_DELETE_INTERVAL", 30))   # how often to look for stalled jobs
+PO_DELETE_MAX_ATTEMPTS = int(os.environ.get("PO_DELETE_MAX_ATTEMPTS", 5))
+# Collections keyed by po_number, deleted after procurement / inventory (counter name -> collection)
+PO_DELETE_COLLECTIONS = [("payments", "payments"), ("logistics", "logistics_shipments"), ("shipment_items", "shipment_items"),
+                         ("invoices", "invoices"), ("po_items", "po_items")]
+
+class PODeleteJob(PeriodicJob):
+    """Runs queued PO cascade deletes; the periodic pass resumes jobs whose worker died."""
+    name = "po-cascade-delete"
+
+    def __init__(self, database, interval: float = PO_DELETE_INTERVAL, batch_size: int = PO_DELETE_BATCH,
+                 pause: float = PO_DELETE_PAUSE, lease_seconds: int = PO_DELETE_LEASE_SECONDS,
+                 max_attempts: int = PO_DELETE_MAX_ATTEMPTS, clock: Callable[[], datetime] = utc_now):
+        super().__init__(interval, clock)
+        self.database = database
+        self.batch_size = batch_size
+        self.pause = pause
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+        self._running: Dict[str, asyncio.Task] = {}
+
+    async def claim(self, job_id: Optional[str] = None) -> Optional[dict]:
+        """Take the lease on a running job (a specific one, or any whose lease has expired)"""
+        now = self.clock()
+        query: Dict[str, Any] = {"status": "Running", "lease_until": {"$lt": now.isoformat()}}
+        if job_id:
+            query["job_id"] = job_id
+        return await self.database.po_delete_jobs.find_one_and_update(
+            query, {"$set": {"lease_until": (now + self.lease).isoformat()}}, projection={"_id": 0}
+        )
+
+    async def run_once(self):
+        while True:
+            job = await self.claim()
+            if not job:
+                return
+            await self.process(job)
+
+    def submit(self, job_id: str):
+        """Start a freshly queued job right away instead of waiting for the next pass"""
+        async def run():
+            job = await self.claim(job_id)
+            if job:
+                await self.process(job)
+        task = asyncio.create_task(run())
+        self._running[job_id] = task
+        task.add_done_callback(lambda _: self._running.pop(job_id, None))
+
+    async def stop(self):
+        for task in list(self._running.values()):
+            task.cancel()
+        await super().stop()
+
+    async def _progress(self, job: dict, counter: str, count: int, phase: str):
+        now = self.clock()
+        await self.database.po_delete_jobs.update_one({"job_id": job["job_id"]}, {
+            "$inc": {f"deleted_counts.{counter}": count},
+            "$set": {"phase": phase, "updated_at": now.isoformat(), "lease_until": (now + self.lease).isoformat()},
+        })
+        if self.pause:
+            await asyncio.sleep(self.pause)
+
+    async def process(self, job: dict):
+        po_number = job["po_number"]
+        try:
+            # Inventory first, a page of procurement IMEIs at a time; the procurement rows
+            # go last so a resumed job still finds the IMEIs it has not cleared yet
+            while True:
+                page = await self.database.procurement.find(
+                    {"po_number": po_number}, {"_id": 1, "imei": 1}
+                ).limit(self.batch_size).to_list(self.batch_size)
+                if not page:
+                    break
+                imeis = [p["imei"] for p in page if p.get("imei")]
+                removed = 0
+                if imeis:
+                    removed = (await self.database.imei_inventory.delete_many({"imei": {"$in": imeis}})).deleted_count
+                    inventory_rollups.invalidate()
+                await self.database.procurement.delete_many({"_id": {"$in": [p["_id"] for p in page]}})
+                await refresh_imei_catalog(imeis)
+                await self._progress(job, "inventory", removed, "procurement")
+                await self._progress(job, "procurement", len(page), "procurement")
+
+            for counter, collection in PO_DELETE_COLLECTIONS:
+                while True:
+                    ids = [d["_id"] for d in await self.database[collection].find(
+                        {"po_number": po_number}, {"_id": 1}
+                    ).limit(self.batch_size).to_list(self.batch_size)]
+                    if not ids:
+                        break
+                    result = await self.database[collection].delete_many({"_id": {"$in": ids}})
+                    await self._progress(job, counter, result.deleted_count, collection)
+
+            await self.database.purchase_orders.delete_one({"po_number": po_number})
+            done = await self.database.po_delete_jobs.find_one_and_update(
+                {"job_id": job["job_id"]},
+                {"$set": {"status": "Completed", "phase": "done", "completed_at": self.clock().isoformat()}},
+                projection={"_id": 0}, return_document=True
+            )
+            user = await self.database.users.find_one({"user_id": job["requested_by"]}, {"_id": 0})
+            if user:
+                await create_audit_log("CASCADE_DELETE", "PurchaseOrder", po_number, User(**user), done.get("deleted_counts", {}))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Lease runs out and the periodic pass retries from where the data stands,
+            # until the job has failed max_attempts times
+            logging.error(f"Cascade delete of {po_number} failed: {e}")
+            now = self.clock().isoformat()
+            await self.database.po_delete_jobs.update_one({"job_id": job["job_id"]}, {
+                "$inc": {"failed_attempts": 1}, "$set": {"last_error": str(e), "updated_at": now},
+            })
+            gave_up = await self.database.po_delete_jobs.update_one(
+                {"job_id": job["job_id"], "status": "Running", "failed_attempts": {"$gte": self.max_attempts}},
+                {"$set": {"status": "Failed", "phase": "failed", "failed_at": now}}
+            )
+            if gave_up.modified_count:
+                logging.error(f"Cascade delete of {po_number} gave up after {self.max_attempts} attempts")
+
+po_delete_job = PODeleteJob(db)
+
 @api_router.delete("/purchase-orders/{po_number}")
 async def delete_purchase_order(po_number: str, current_user: User = Depends(get_current_user)):
+    from uuid import uuid4
     if current_user.role != "Admin":
         raise HTTPException(status_code=403, detail="Only Admin can delete records")
     
     # Check if PO exists
-    po = await db.purchase_orders.find_one({"po_number": po_number})
+    po = await db.purchase_orders.find_one({"po_number": po_number}, {"_id": 0, "po_number": 1})
     if not po:
         raise HTTPException(status_code=404, detail="PO not found")
     
-    # CASCADE DELETE - Delete all related records
-    deleted_counts = {
-        "procurement": 0,
-        "payments": 0,
-        "logistics": 0,
-        "inventory": 0,
-        "invoices": 0
-    }
-    
-    # 1. Get all procurement records for this PO (to get IMEIs)
-    procurement_records = await db.procurement.find({"po_number": po_number}).to_list(1000)
-    imeis_to_delete = [p.get("imei") for p in procurement_records if p.get("imei")]
-    
-    # 2. Delete related inventory items
-    if imeis_to_delete:
-        inv_result = await db.imei_inventory.delete_many({"imei": {"$in": imeis_to_delete}})
-        deleted_counts["inventory"] = inv_result.deleted_count
-    
-    # 3. Delete all procurement records for this PO
-    proc_result = await db.procurement.delete_many({"po_number": po_number})
-    deleted_counts["procurement"] = proc_result.deleted_count
-    
-    # 4. Delete all payments for this PO
-    pay_result = await db.payments.delete_many({"po_number": po_number})
-    deleted_counts["payments"] = pay_result.deleted_count
-    
-    # 5. Delete all logistics/shipments for this PO
-    log_result = await db.logistics_shipments.delete_many({"po_number": po_number})
-    deleted_counts["logistics"] = log_result.deleted_count
-    
-    # 6. Delete all invoices for this PO
-    inv_result = await db.invoices.delete_many({"po_number": po_number})
-    deleted_counts["invoices"] = inv_result.deleted_count
-    
-    # 7. Finally delete the PO
-    await db.purchase_orders.delete_one({"po_number": po_number})
+    existing = await db.po_delete_jobs.find_one({"po_number": po_number, "status": "Running"}, {"_id": 0})
+    if existing:
+        return {"message": f"Purchase order {po_number} is already being deleted", "job": existing}
     
-    await create_audit_log("CASCADE_DELETE", "PurchaseOrder", po_number, current_user, deleted_counts)
-    return {
-        "message": f"Purchase order {po_number} and all related records deleted successfully",
-        "deleted_counts": deleted_counts
+    now = datetime.now(timezone.utc).isoformat()
+    job = {
+        "job_id": str(uuid4()),
+        "po_number": po_number,
+        "status": "Running",
+        "phase": "queued",
+        "expected": {
+            "procurement": await db.procurement.count_documents({"po_number": po_number}),
+            **{counter: await db[collection].count_documents({"po_number": po_number}) for counter, collection in PO_DELETE_COLLECTIONS},
+        },
+        "deleted_counts": {"procurement": 0, "inventory": 0, **{counter: 0 for counter, _ in PO_DELETE_COLLECTIONS}},
+        "requested_by": current_user.user_id,
+        "failed_attempts": 0,
+        "lease_until": now,
+        "created_at": now,
+        "updated_at": now,
     }
+    await db.po_delete_jobs.insert_one(job)
+    await db.purchase_orders.update_one({"po_number": po_number}, {"$set": {"status": "Deleting", "updated_at": now}})
+    po_delete_job.submit(job["job_id"])
+    job.pop("_id", None)
+    return {"message": f"Deletion of purchase order {po_number} and all related records has started", "job": job}
+
+@api_router.get("/purchase-orders/deletions/{job_id}")
+async def get_po_delete_job(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await db.po_delete_jobs.find_one({"job_id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    expected = sum(job.get("expected", {}).values())
+    done = sum(v for k, v in job.get("deleted_counts", {}).items() if k != "inventory")
+    job["progress"] = 1.0 if job["status"] == "Completed" else (min(done / expected, 0.99) if expected else 0.0)
+    return job
+# ────────────────────────────────────────────────────────────────────────────────
+
+def reset_in_process_state():
+    """Drop in-process caches and sessions derived from cleared collections"""
+    inventory_rollups.invalidate()
+    stock_take_sessions.clear()
+    scan_dedup.clear()
+    audit_archive_job.forget_archives()
 
 @api_router.delete("/admin/clear-all-data")
-async def clear_all_data(current_user: User = Depends(get_current_user)):
-    """Clear all transactional data while preserving user accounts"""
+async def clear_all_data(fast: bool = False, current_user: User = Depends(get_current_user)):
+    """Clear all transactional data while preserving user accounts.
+
+    fast=true drops the collections and rebuilds their indexes (see reset_database)
+    instead of deleting document by document; counts are then approximate.
+    """
     if current_user.role != "Admin":
         raise HTTPException(status_code=403, detail="Only Admin can clear data")
     
+    if fast:
+        deleted_counts = await reset_database(db)
+        reset_in_process_state()
+        await create_audit_log("CLEAR_ALL_DATA", "System", "all", current_user, {"mode": "fast", **deleted_counts})
+        return {
+            "message": "All transactional data cleared successfully. User accounts preserved.",
+            "deleted_counts": deleted_counts
+        }
+    
     deleted_counts = {}
     
     # Delete all transactional data
-    deleted_counts["purchase_orders"] = (await db.purchase_orders.delete_many({})).deleted_count
-    deleted_counts["procurement"] = (await db.procurement.delete_many({})).deleted_count
-    deleted_counts["payments"] = (await db.payments.delete_many({})).deleted_count
-    deleted_counts["logistics_shipments"] = (await db.logistics_shipments.delete_many({})).deleted_count
-    deleted_counts["imei_inventory"] = (await db.imei_inventory.delete_many({})).deleted_count
-    deleted_counts["invoices"] = (await db.invoices.delete_many({})).deleted_count
-    deleted_counts["audit_logs"] = (await db.audit_logs.delete_many({})).deleted_count
+    for collection in await reset_collection_names(db):
+        deleted_counts[collection] = (await db[collection].delete_many({})).deleted_count
+    reset_in_process_state()
     
     await create_audit_log("CLEAR_ALL_DATA", "System", "all", current_user, deleted_counts)
     
@@ -2118,10 +4885,12 @@ async def delete_procurement(procurement_id: str, current_user: User = Depends(g
     proc = await db.procurement.find_one({"procurement_id": procurement_id})
     if proc:
         await db.imei_inventory.delete_one({"imei": proc.get("imei")})
+        inventory_rollups.invalidate()
     
     result = await db.procurement.delete_one({"procurement_id": procurement_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Procurement record not found")
+    await refresh_imei_catalog([proc.get("imei")])
     
     await create_audit_log("DELETE", "Procurement", procurement_id, current_user, {})
     return {"message": "Procurement record deleted successfully"}
@@ -2134,6 +4903,8 @@ async def delete_inventory(imei: str, current_user: User = Depends(get_current_u
     result = await db.imei_inventory.delete_one({"imei": imei})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="IMEI not found")
+    inventory_rollups.invalidate()
+    await refresh_imei_catalog([imei])
     
     await create_audit_log("DELETE", "IMEI", imei, current_user, {})
     return {"message": "Inventory item deleted successfully"}
@@ -2146,6 +4917,7 @@ async def delete_shipment(shipment_id: str, current_user: User = Depends(get_cur
     result = await db.logistics_shipments.delete_one({"shipment_id": shipment_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Shipment not found")
+    await db.shipment_items.delete_many({"shipment_id": shipment_id})
     
     await create_audit_log("DELETE", "Shipment", shipment_id, current_user, {})
     return {"message": "Shipment deleted successfully"}
@@ -2179,12 +4951,14 @@ async def delete_sales_order(so_number: str, current_user: User = Depends(get_cu
     if current_user.role != "Admin":
         raise HTTPException(status_code=403, detail="Only Admin can delete records")
     
-    result = await db.sales_orders.delete_one({"so_number": so_number})
-    if result.deleted_count == 0:
+    so = await db.sales_orders.find_one_and_delete({"so_number": so_number})
+    if not so:
         raise HTTPException(status_code=404, detail="Sales order not found")
     
-    await create_audit_log("DELETE", "SalesOrder", so_number, current_user, {})
-    return {"message": "Sales order deleted successfully"}
+    released = await release_imeis(so.get("sales_order_id"), so.get("imei_list", []))
+    
+    await create_audit_log("DELETE", "SalesOrder", so_number, current_user, {"released": released})
+    return {"message": "Sales order deleted successfully", "released": released}
 
 # Chatbot Logic
 SYSTEM_PROMPT = """
@@ -2326,9 +5100,25 @@ logger = logging.getLogger(__name__)
 @app.on_event("startup")
 async def startup_db():
     await create_indexes()
+    # Keep a reference so the backfill task is not garbage-collected mid-run
+    app.state.imei_catalog_backfill = asyncio.create_task(ensure_imei_catalog())
+    app.state.shipment_items_migration = asyncio.create_task(migrate_shipment_items())
+    app.state.inventory_fields_backfill = asyncio.create_task(backfill_procured_inventory_fields())
+    await notification_broker.start(db)
+    gap_escalation_job.start()
+    audit_sink.start()
+    audit_archive_job.start()
+    po_delete_job.start()
+    po_archive_job.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await po_archive_job.stop()
+    await po_delete_job.stop()
+    await audit_archive_job.stop()
+    await gap_escalation_job.stop()
+    await notification_broker.stop()
+    await audit_sink.stop()
     client.close()
 
 if __name__ == "__main__":
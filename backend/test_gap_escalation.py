@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Test that gap-reverse notifications escalate once, driven by an injected clock"""
+import asyncio
+import os
+from datetime import datetime, timezone, timedelta
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "magnova_test")
+
+async def _run_escalation():
+    import server
+    database = AsyncMongoMockClient()["escalation_test"]
+    raised_at = datetime(2026, 1, 5, 9, 0, tzinfo=timezone.utc)
+    now = [raised_at]
+    alerts = []
+
+    async def record_alert(to, subject, body):
+        alerts.append((to, subject))
+
+    await database.users.insert_one({"user_id": "m1", "email": "manager@magnova.com", "role": "Manager"})
+    await database.notifications.insert_one({
+        "type": "gap_reverse", "procurement_id": "p1", "po_number": "PO-MAG-00001", "target_user_id": "u1",
+        "message": "Resolve the issue in 48 hours", "status": "pending", "is_escalated": False,
+        "created_at": raised_at.isoformat(), "deadline": (raised_at + timedelta(hours=48)).isoformat(),
+    })
+    broker = server.NotificationBroker()
+    job = server.GapEscalationJob(database, broker, clock=lambda: now[0], alert_sender=record_alert)
+
+    # Inside the 48h window nothing happens
+    now[0] = raised_at + timedelta(hours=47)
+    assert await job.run_once() == 0
+    assert alerts == []
+
+    # Past the deadline the notification escalates and managers are alerted once
+    now[0] = raised_at + timedelta(hours=49)
+    assert await job.run_once() == 1
+    assert len(alerts) == 1 and alerts[0][0] == "manager@magnova.com"
+    notification = await database.notifications.find_one({"procurement_id": "p1"})
+    assert notification["is_escalated"] is True
+    assert notification["message"].startswith("URGENT: ")
+
+    # A later tick does not escalate or alert again
+    now[0] = raised_at + timedelta(hours=60)
+    assert await job.run_once() == 0
+    assert len(alerts) == 1
+    assert await database.notifications.count_documents({"is_escalated": True}) == 1
+
+def test_gap_escalation_with_fake_clock():
+    """Only a tick past the deadline escalates, and only once"""
+    asyncio.run(_run_escalation())
+
+if __name__ == "__main__":
+    test_gap_escalation_with_fake_clock()
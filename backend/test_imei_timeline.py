@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Test that procured units start their IMEI timeline with a Procured event"""
+import asyncio
+import os
+from datetime import datetime, timezone
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "magnova_test")
+
+async def _run_procurement_timeline():
+    import server
+
+    test_db = AsyncMongoMockClient()["timeline_test"]
+    original_db, original_audit = server.db, server.audit_sink.collection
+    server.db, server.audit_sink.collection = test_db, test_db.audit_logs
+    try:
+        user = server.User(user_id="u-1", email="buyer@example.com", name="Buyer", organization="Nova",
+                           role="Purchase", created_at=datetime.now(timezone.utc))
+        await test_db.purchase_orders.insert_one({"po_number": "PO-1", "items": []})
+        # Scanned before procurement: already has a timeline of its own
+        await test_db.imei_inventory.insert_one({"imei": "350000000000003", "status": "Inward Nova"})
+
+        def entry(imei):
+            return server.ProcurementCreate(po_number="PO-1", vendor_name="Acme", store_location="Hyderabad",
+                                            imei=imei, device_model="iPhone 15", purchase_quantity=1,
+                                            purchase_price=70000)
+
+        await server.create_procurement(entry("350000000000001"), user)
+        errors = []
+        await server.ingest_procurement([(2, entry("350000000000002")), (3, entry("350000000000003"))], user, errors)
+        assert errors == []
+
+        for imei in ("350000000000001", "350000000000002"):
+            timeline = (await server.get_imei_timeline(imei, current_user=user))["events"]
+            assert [(e["event"], e["from_status"], e["status"]) for e in timeline] == [("procured", None, "Procured")]
+            assert timeline[0]["source"] == "procurement" and timeline[0]["location"] == "Hyderabad"
+            assert timeline[0]["reference"] == (await test_db.procurement.find_one({"imei": imei}))["procurement_id"]
+        assert (await server.get_imei_timeline("350000000000003", current_user=user))["events"] == []
+    finally:
+        server.db, server.audit_sink.collection = original_db, original_audit
+
+def test_procured_units_have_timeline():
+    """Single and bulk procurement both record the Procured creation event"""
+    print("\nTesting procurement timeline events...")
+    asyncio.run(_run_procurement_timeline())
+
+if __name__ == "__main__":
+    test_procured_units_have_timeline()
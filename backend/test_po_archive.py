@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Test that the PO archive job only moves fully paid, closed purchase orders"""
+import asyncio
+import os
+from datetime import datetime, timezone, timedelta
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "magnova_test")
+
+async def _seed_closed_po(database, po_number: str, total_value: float, payments: list):
+    old = (datetime.now(timezone.utc) - timedelta(days=400)).isoformat()
+    await database.purchase_orders.insert_one({"po_number": po_number, "approval_status": "Approved", "status": "Approved",
+                                              "total_value": total_value, "created_at": old, "updated_at": old})
+    await database.procurement.insert_one({"po_number": po_number, "imei": f"{po_number}-1", "gap_qty": 0, "created_at": old})
+    await database.imei_inventory.insert_one({"imei": f"{po_number}-1", "status": "Sold"})
+    for payment_type, amount in payments:
+        await database.payments.insert_one({"po_number": po_number, "payment_type": payment_type, "amount": amount,
+                                            "status": "Completed", "created_at": old})
+
+async def _run_archive():
+    import server
+    database = AsyncMongoMockClient()["archive_test"]
+    await _seed_closed_po(database, "PO-PAID", 1000, [("internal", 1000), ("external", 1000)])
+    await _seed_closed_po(database, "PO-UNPAID", 1000, [])
+    await _seed_closed_po(database, "PO-PARTIAL", 1000, [("internal", 1000), ("external", 400)])
+
+    archived = await server.POArchiveJob(database).run_once()
+    assert archived == 1
+    assert await database.purchase_orders_archive.count_documents({"po_number": "PO-PAID"}) == 1
+    assert await database.payments_archive.count_documents({}) == 2
+    hot = sorted(po["po_number"] for po in await database.purchase_orders.find({}).to_list(None))
+    assert hot == ["PO-PARTIAL", "PO-UNPAID"]
+    assert await database.procurement.count_documents({"po_number": {"$in": hot}}) == 2
+
+def test_unpaid_po_is_not_archived():
+    """POs without payments, or only partly paid, stay in the hot collections"""
+    asyncio.run(_run_archive())
+
+if __name__ == "__main__":
+    test_unpaid_po_is_not_archived()
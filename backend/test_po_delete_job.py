@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""Test that a PO cascade delete that keeps failing is given up on"""
+import asyncio
+import os
+from datetime import datetime, timezone, timedelta
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "magnova_test")
+
+async def _run_failing_delete():
+    import server
+    database = AsyncMongoMockClient()["po_delete_test"]
+    now = [datetime(2026, 1, 1, tzinfo=timezone.utc)]
+    job = server.PODeleteJob(database, pause=0, lease_seconds=60, max_attempts=3, clock=lambda: now[0])
+
+    await database.purchase_orders.insert_one({"po_number": "PO-1", "status": "Deleting"})
+    await database.procurement.insert_one({"po_number": "PO-1", "imei": "350000000000001"})
+    await database.imei_inventory.insert_one({"imei": "350000000000001", "status": "Procured"})
+    await database.po_delete_jobs.insert_one({"job_id": "job-1", "po_number": "PO-1", "status": "Running", "requested_by": "u-1",
+                                              "failed_attempts": 0, "lease_until": (now[0] - timedelta(seconds=1)).isoformat()})
+
+    # Fails before the procurement page is removed, so every retry hits it again
+    def broken_invalidate():
+        raise RuntimeError("rollups unavailable")
+    original_invalidate = server.inventory_rollups.invalidate
+    server.inventory_rollups.invalidate = broken_invalidate
+    try:
+        for attempt in range(1, 5):
+            await job.run_once()
+            stored = await database.po_delete_jobs.find_one({"job_id": "job-1"})
+            assert stored["failed_attempts"] == min(attempt, 3)
+            assert stored["status"] == ("Failed" if attempt >= 3 else "Running")
+            assert stored["last_error"] == "rollups unavailable"
+            now[0] += timedelta(seconds=61)  # lease expires, so the next pass may claim it again
+        assert await job.claim() is None
+    finally:
+        server.inventory_rollups.invalidate = original_invalidate
+
+def test_failing_delete_stops_after_max_attempts():
+    """The job is marked Failed after max_attempts errors and is no longer claimed"""
+    asyncio.run(_run_failing_delete())
+
+if __name__ == "__main__":
+    test_failing_delete_stops_after_max_attempts()
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""Test PO import row validation on spreadsheet-typed cells"""
+import os
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "magnova_test")
+
+def test_numeric_imei_column_with_blank_rows():
+    """Whole-number IMEI cells keep their digits when the column also has blank (NaN) cells"""
+    import server
+
+    columns = ["vendor", "location", "brand", "model", "rate", "po_ref", "imei"]
+    rows = [
+        ("Acme", "Hyderabad", "Apple", "iPhone 15", 70000, "A", 356789012345678),
+        ("Acme", "Hyderabad", "Apple", "iPhone 15", 70000, "A", float("nan")),
+        ("Acme", "Hyderabad", "Apple", "iPhone 15", 70000, "A", None),
+        ("Acme", "Hyderabad", "Apple", "iPhone 15", 70000, "A", 356789012345679.0),
+    ]
+    items, errors = server._validate_po_rows(rows, columns, 2)
+
+    assert errors == []
+    assert [item["imei"] for _, item in items] == ["356789012345678", None, None, "356789012345679"]
+
+if __name__ == "__main__":
+    test_numeric_imei_column_with_blank_rows()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Test that overlapping sales orders never reserve the same IMEI twice"""
+import asyncio
+import os
+from datetime import datetime, timezone
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "magnova_test")
+
+async def _run_overlapping_orders():
+    import server
+
+    # In-memory database so the check always runs and real inventory is never touched
+    test_db = AsyncMongoMockClient()["reservation_test"]
+    original_db = server.db
+    server.db = test_db
+    try:
+        imeis = [f"35{i:013d}" for i in range(200)]
+        await test_db.imei_inventory.insert_many(
+            [{"imei": imei, "status": "Available"} for imei in imeis]
+        )
+
+        # Five orders that each want 80 units from overlapping windows of the same stock
+        orders = {f"so-{n}": imeis[n * 30:n * 30 + 80] for n in range(5)}
+        results = await asyncio.gather(*[server.reserve_imeis(so_id, wanted) for so_id, wanted in orders.items()])
+
+        winners = {}
+        for (so_id, wanted), (reserved, unavailable) in zip(orders.items(), results):
+            print(f"   {so_id}: reserved {len(reserved)}, unavailable {len(unavailable)}")
+            assert sorted(reserved + unavailable) == sorted(wanted)
+            for imei in reserved:
+                assert imei not in winners, f"{imei} reserved by {winners[imei]} and {so_id}"
+                winners[imei] = so_id
+
+        reserved_in_db = await test_db.imei_inventory.count_documents({"status": "Reserved"})
+        assert reserved_in_db == len(winners)
+        # Every requested unit went to exactly one of the orders
+        assert len(winners) == len(set(imeis[:4 * 30 + 80]))
+
+        # Releasing one order only frees that order's units
+        released = await server.release_imeis("so-0", orders["so-0"])
+        assert released == sum(1 for so_id in winners.values() if so_id == "so-0")
+        assert await test_db.imei_inventory.count_documents({"status": "Reserved"}) == len(winners) - released
+        print(f"   {len(winners)} units reserved without overlap, {released} released")
+    finally:
+        server.db = original_db
+
+def test_overlapping_sales_orders():
+    """Concurrent reservations over overlapping IMEI sets must not double-reserve"""
+    print("\nTesting overlapping sales order reservations...")
+    asyncio.run(_run_overlapping_orders())
+
+async def _run_failed_order_insert():
+    import server
+    from pymongo.errors import DuplicateKeyError
+
+    test_db = AsyncMongoMockClient()["reservation_rollback_test"]
+    original_db = server.db
+    server.db = test_db
+    try:
+        imeis = [f"35{i:013d}" for i in range(3)]
+        await test_db.imei_inventory.insert_many([{"imei": imei, "status": "Available"} for imei in imeis])
+        # The next order number is already taken, so storing the order fails after reservation
+        await test_db.sales_orders.create_index("so_number", unique=True)
+        await test_db.sales_orders.insert_one({"so_number": "SO-MAG-00002"})
+
+        user = server.User(user_id="u-1", email="sales@example.com", name="Sales", organization="Magnova",
+                           role="Sales", created_at=datetime.now(timezone.utc))
+        order = server.SalesOrderCreate(customer_name="Retail Co", customer_type="Retail", total_quantity=3,
+                                        total_amount=210000, imei_list=imeis)
+        try:
+            await server.create_sales_order(order, user)
+            raise AssertionError("order insert should have failed")
+        except DuplicateKeyError:
+            pass
+
+        assert await test_db.imei_inventory.count_documents({"status": "Available"}) == len(imeis)
+        assert await test_db.imei_inventory.count_documents({"reserved_for": {"$exists": True}}) == 0
+    finally:
+        server.db = original_db
+
+def test_failed_order_insert_releases_reservations():
+    """Units reserved for an order that could not be stored go back to Available"""
+    print("\nTesting reservation rollback on failed sales order insert...")
+    asyncio.run(_run_failed_order_insert())
+
+if __name__ == "__main__":
+    test_overlapping_sales_orders()
+    test_failed_order_insert_releases_reservations()